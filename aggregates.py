@@ -0,0 +1,76 @@
+# Поля отзыва с одиночной оценкой 1-5
+RATING_FIELDS = ['satisfaction_rating', 'interaction_process_rating', 'overall_satisfaction']
+
+
+def empty_counter():
+    return {'sum': 0, 'count': 0, 'histogram': [0, 0, 0, 0, 0]}
+
+
+def add_rating(counter, rating):
+    add_rating_count(counter, rating, 1)
+
+
+# Учет сразу нескольких одинаковых оценок
+def add_rating_count(counter, rating, count):
+    counter['sum'] += rating * count
+    counter['count'] += count
+    if 1 <= rating <= 5:
+        counter['histogram'][rating - 1] += count
+
+
+# Накопительные счетчики по всем отзывам: суммы, количества и гистограммы
+# оценок, плюс число отзывов по каждой позиции. Обновляются за O(1) на отзыв.
+class ReviewAggregates:
+    def __init__(self):
+        self.review_count = 0
+        self.ratings = {field: empty_counter() for field in RATING_FIELDS}
+        self.criteria = {}
+        self.positions = {}
+
+    def add(self, review):
+        self.review_count += 1
+        for field in RATING_FIELDS:
+            if field in review:
+                add_rating(self.ratings[field], review[field])
+        for key, rating in review.get('multiple_ratings', {}).items():
+            if key not in self.criteria:
+                self.criteria[key] = empty_counter()
+            add_rating(self.criteria[key], rating)
+        for position in review.get('positions', []):
+            self.positions[position] = self.positions.get(position, 0) + 1
+
+    # Среднее по полю или критерию, None если данных нет
+    def mean(self, key):
+        counter = self.ratings.get(key) or self.criteria.get(key)
+        if not counter or not counter['count']:
+            return None
+        return counter['sum'] / counter['count']
+
+    def to_dict(self):
+        return {
+            'review_count': self.review_count,
+            'ratings': self.ratings,
+            'criteria': self.criteria,
+            'positions': self.positions,
+        }
+
+    @classmethod
+    def from_dict(cls, raw):
+        aggregates = cls()
+        aggregates.review_count = raw['review_count']
+        aggregates.ratings.update(raw['ratings'])
+        aggregates.criteria = raw['criteria']
+        aggregates.positions = raw['positions']
+        return aggregates
+
+    # Пересчет с нуля по исходным данным {user_id: {'reviews': [...]}}
+    @classmethod
+    def rebuild(cls, data):
+        aggregates = cls()
+        for user_info in data.values():
+            for review in user_info.get('reviews', []):
+                aggregates.add(review)
+        return aggregates
+
+    def __eq__(self, other):
+        return isinstance(other, ReviewAggregates) and self.to_dict() == other.to_dict()
@@ -0,0 +1,165 @@
+# Колоночное представление отзывов для аналитики. Оценки, битовые маски
+# позиций и даты лежат в плоских массивах array (дешевое добавление по одному
+# отзыву), а для расчета копируются в массивы NumPy. Разбивки по позициям,
+# распределения, медианы и тренды считаются векторными операциями, без
+# обхода словарей отзывов. NumPy импортируется при первом расчете, чтобы не
+# замедлять запуск бота.
+import threading
+import time
+from array import array
+from datetime import datetime
+
+from aggregates import RATING_FIELDS
+
+DAY = 24 * 60 * 60
+# Значение для отсутствующей оценки
+NO_RATING = 0
+
+
+# ISO-дата отзыва -> секунды Unix, NaN для старых отзывов без даты
+def parse_timestamp(created_at):
+    if not created_at:
+        return float('nan')
+    try:
+        return datetime.fromisoformat(created_at).timestamp()
+    except ValueError:
+        return float('nan')
+
+
+# Количество, среднее, медиана и гистограмма 1-5 по массиву оценок
+def rating_stats(values):
+    import numpy as np
+    values = values[values != NO_RATING]
+    if not len(values):
+        return {'count': 0, 'mean': None, 'median': None, 'histogram': [0] * 5}
+    return {
+        'count': int(len(values)),
+        'mean': float(values.mean()),
+        'median': float(np.median(values)),
+        'histogram': np.bincount(values, minlength=6)[1:6].tolist(),
+    }
+
+
+class ReviewColumns:
+    def __init__(self, positions, criteria):
+        if len(positions) > 64:
+            raise ValueError("At most 64 positions fit into a position bitmask")
+        self.positions = list(positions)
+        self.fields = RATING_FIELDS + list(criteria)
+        self.lock = threading.RLock()
+        self.loaded = False
+        self._clear()
+
+    def _clear(self):
+        self.ratings = {field: array('b') for field in self.fields}
+        self.position_masks = array('Q')
+        self.timestamps = array('d')
+        self._position_bits = {position: 1 << i for i, position in enumerate(self.positions)}
+        self._arrays = None
+        # Наибольший id загруженного отзыва, с него sync() догружает новые
+        self.last_id = 0
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def add(self, review):
+        multiple_ratings = review.get('multiple_ratings', {})
+        with self.lock:
+            for field in self.fields:
+                rating = review.get(field) if field in RATING_FIELDS else multiple_ratings.get(field)
+                self.ratings[field].append(rating if isinstance(rating, int) and 1 <= rating <= 5 else NO_RATING)
+            mask = 0
+            for position in review.get('positions', []):
+                mask |= self._position_bits.get(position, 0)
+            self.position_masks.append(mask)
+            self.timestamps.append(parse_timestamp(review.get('created_at')))
+            self.last_id = max(self.last_id, review.get('id') or 0)
+            self._arrays = None
+
+    def load(self, reviews):
+        with self.lock:
+            self._clear()
+            for review in reviews:
+                self.add(review)
+            self.loaded = True
+
+    # Догружает отзывы, записанные после последнего загруженного (в том числе
+    # другим процессом). Колонки перечитываются целиком, только если еще не
+    # загружены или данные в хранилище заменили.
+    def sync(self, store):
+        with self.lock:
+            if not self.loaded:
+                self.load(review for _, _, _, review in store.iter_reviews())
+                return self
+            last_id = store.last_review_id()
+            if last_id == self.last_id:
+                return self
+            if last_id > self.last_id:
+                for _, _, _, review in store.iter_reviews(after_id=self.last_id):
+                    self.add(review)
+            if last_id != self.last_id or len(self) != store.review_count():
+                self.load(review for _, _, _, review in store.iter_reviews())
+            return self
+
+    # Копия колонок в NumPy, кэшируется до следующего добавления
+    def _snapshot(self):
+        import numpy as np
+        with self.lock:
+            if self._arrays is None:
+                self._arrays = (
+                    {field: np.array(column, dtype=np.int8) for field, column in self.ratings.items()},
+                    np.array(self.position_masks, dtype=np.uint64),
+                    np.array(self.timestamps, dtype=np.float64),
+                )
+            return self._arrays
+
+    # Матрица (отзыв x позиция) принадлежности отзывов позициям
+    def _position_matrix(self, masks):
+        import numpy as np
+        bits = np.arange(len(self.positions), dtype=np.uint64)
+        return ((masks[:, None] >> bits) & np.uint64(1)).astype(bool)
+
+    # Статистика по каждой оценке: {поле: rating_stats}
+    def distributions(self):
+        ratings, _, _ = self._snapshot()
+        return {field: rating_stats(values) for field, values in ratings.items()}
+
+    # По каждой позиции: число отзывов и статистика оценки field
+    def position_breakdown(self, field='overall_satisfaction'):
+        ratings, masks, _ = self._snapshot()
+        values = ratings[field]
+        matrix = self._position_matrix(masks)
+        counts = matrix.sum(axis=0)
+        return [
+            (position, int(counts[i]), rating_stats(values[matrix[:, i]]))
+            for i, position in enumerate(self.positions)
+            if counts[i]
+        ]
+
+    # Тренд за последние days дней: статистика за период и за предыдущий
+    # такой же период, плюс разбивка периода на отрезки по bucket_days дней
+    # (первый отрезок - самые свежие отзывы)
+    def trend(self, field='overall_satisfaction', days=30, bucket_days=7, now=None):
+        import numpy as np
+        ratings, _, timestamps = self._snapshot()
+        values = ratings[field]
+        now = time.time() if now is None else now
+        with np.errstate(invalid='ignore'):
+            age = (now - timestamps) / DAY  # NaN для отзывов без даты
+            current = (age >= 0) & (age < days)
+            previous = (age >= days) & (age < 2 * days)
+        buckets = (age[current] // bucket_days).astype(np.int64)
+        bucket_count = -(-days // bucket_days)
+        rated = values[current] != NO_RATING
+        counts = np.bincount(buckets, minlength=bucket_count)
+        rated_counts = np.bincount(buckets[rated], minlength=bucket_count)
+        sums = np.bincount(buckets[rated], weights=values[current][rated], minlength=bucket_count)
+        return {
+            'current': rating_stats(values[current]),
+            'previous': rating_stats(values[previous]),
+            'buckets': [
+                (i * bucket_days, min((i + 1) * bucket_days, days), int(counts[i]),
+                 float(sums[i] / rated_counts[i]) if rated_counts[i] else None)
+                for i in range(bucket_count)
+            ],
+        }
@@ -0,0 +1,226 @@
+# Офлайн-бенчмарк основных сценариев бота на синтетических данных:
+#   python bench.py --reviews 10000 --backend json
+#   python bench.py --reviews 1000000 --concurrency 300 --iterations 100
+# Генерирует messages.json нужного размера во временном каталоге, прогоняет
+# настоящие обработчики через TeleBot с подмененной отправкой запросов
+# (ответы Telegram имитируются, все вызовы записываются) и печатает
+# пропускную способность и задержки p50/p99 по каждому сценарию.
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+NAMES = ['Anna', 'Boris', 'Olga', 'Ivan', 'Maria', 'Pavel', 'Elena', 'Dmitry', 'Sofia', 'Alex']
+WORDS = ['tasks', 'backend', 'design', 'опыт', 'команда', 'research', 'deploy', 'интервью', 'growth', 'mentor']
+
+
+# Поток синтетических отзывов в формате messages.json, без сборки всего в памяти
+def generate_dataset(path, reviews, reviews_per_user, positions, criteria, seed=1):
+    rng = random.Random(seed)
+    users = max(1, reviews // reviews_per_user)
+    review_id = itertools.count(1)
+    now = time.time()
+    with open(path, 'w') as f:
+        f.write('{')
+        for user_index in range(users):
+            count = reviews_per_user if user_index < users - 1 else reviews - reviews_per_user * (users - 1)
+            user_info = {
+                'name': f"{rng.choice(NAMES)} User{user_index}",
+                'nickname': f"@user{user_index}",
+                'reviews': [
+                    {
+                        'experience_description': ' '.join(rng.choice(WORDS) for _ in range(12)),
+                        'satisfaction_rating': rng.randint(1, 5),
+                        'interaction_process_rating': rng.randint(1, 5),
+                        'multiple_ratings': {criterion: rng.randint(1, 5) for criterion in criteria},
+                        'professional_development_effect': ' '.join(rng.choice(WORDS) for _ in range(8)),
+                        'overall_satisfaction': rng.randint(1, 5),
+                        'positions': rng.sample(positions, rng.randint(1, 3)),
+                        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S+00:00', time.gmtime(now - rng.uniform(0, 90 * 86400))),
+                        'id': next(review_id),
+                    }
+                    for _ in range(count)
+                ],
+            }
+            if user_index:
+                f.write(',')
+            f.write(f"{json.dumps(str(1000000 + user_index))}: {json.dumps(user_info)}")
+        f.write('}')
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[int(round(q * (len(ordered) - 1)))]
+
+
+def report(name, samples, elapsed=None):
+    if not samples:
+        return
+    elapsed = elapsed if elapsed is not None else sum(samples)
+    print(
+        f"{name:<22} {len(samples):>7} ops {len(samples) / elapsed:>10.1f} ops/s "
+        f"p50 {1000 * percentile(samples, 0.5):>8.2f} ms  p99 {1000 * percentile(samples, 0.99):>8.2f} ms"
+    )
+
+
+class FakeResponse:
+    def __init__(self, payload):
+        self.status_code = 200
+        self.reason = 'OK'
+        self.text = json.dumps(payload)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+# Подменяет HTTP-запросы telebot: записывает вызов и возвращает правдоподобный ответ
+class RecordingTransport:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.message_ids = itertools.count(1)
+
+    def __call__(self, method, url, **kwargs):
+        method_name = url.rsplit('/', 1)[-1]
+        params = kwargs.get('params') or {}
+        with self.lock:
+            self.calls[method_name] = self.calls.get(method_name, 0) + 1
+            message_id = next(self.message_ids)
+        result = True
+        if method_name.startswith('send') or method_name == 'editMessageText':
+            result = {'message_id': message_id, 'date': 0, 'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'}}
+        return FakeResponse({'ok': True, 'result': result})
+
+
+class Client:
+    def __init__(self, bot_module):
+        from telebot import types
+        self.types = types
+        self.bot_module = bot_module
+        self.update_ids = itertools.count(1)
+
+    def message(self, user_id, text):
+        update_id = next(self.update_ids)
+        return self.types.Update.de_json({'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': 0, 'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench', 'last_name': str(user_id), 'username': f"bench{user_id}"},
+            'text': text,
+        }})
+
+    def callback(self, user_id, data):
+        update_id = next(self.update_ids)
+        return self.types.Update.de_json({'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'chat_instance': str(user_id), 'data': data,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Bench'},
+            'message': {'message_id': 1, 'date': 0, 'chat': {'id': user_id, 'type': 'private'}, 'text': ''},
+        }})
+
+    # Обновления одного полного отзыва
+    def review_updates(self, user_id):
+        updates = [self.message(user_id, 'Write a review'), self.callback(user_id, 'toggle_position_2'), self.callback(user_id, 'positions_done')]
+        answers = ['Benchmark experience'] + ['4'] * (2 + len(self.bot_module.RATING_CRITERIA)) + ['Benchmark effect', '5']
+        return updates + [self.message(user_id, answer) for answer in answers]
+
+    # Обработка обновлений до конца, включая исходящие запросы
+    def process(self, updates):
+        self.bot_module.bot.process_new_updates(updates)
+        self.bot_module.bot.workers.join()
+        self.bot_module.sender.join()
+
+    def timed(self, updates):
+        started = time.perf_counter()
+        self.process(updates)
+        return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark bot flows on a synthetic dataset.")
+    parser.add_argument('--reviews', type=int, default=10000)
+    parser.add_argument('--reviews-per-user', type=int, default=3)
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default='json')
+    parser.add_argument('--iterations', type=int, default=200, help="operations per read flow")
+    parser.add_argument('--concurrency', type=int, default=100, help="users writing reviews at the same time")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_DIR)
+    os.chdir(tempfile.mkdtemp(prefix='tiddle-bench-'))
+    os.makedirs('data')
+    os.environ.setdefault('API_TOKEN', '0:bench')
+    os.environ['STORAGE_BACKEND'] = args.backend
+    os.environ['SESSION_DB'] = ''
+    # Лимиты Telegram не имитируем: меряем сам бот
+    os.environ.setdefault('SEND_GLOBAL_RATE', '1000000')
+    os.environ.setdefault('SEND_CHAT_RATE', '1000000')
+    os.environ.setdefault('SEND_CHAT_BURST', '1000000')
+
+    from telebot import apihelper
+    transport = RecordingTransport()
+    apihelper.CUSTOM_REQUEST_SENDER = transport
+
+    import questionnaire
+    import storage
+    started = time.perf_counter()
+    generate_dataset('data/messages.json', args.reviews, args.reviews_per_user,
+                     questionnaire.POSITIONS, questionnaire.RATING_CRITERIA, args.seed)
+    print(f"Generated {args.reviews} reviews in {time.perf_counter() - started:.1f} s "
+          f"({os.path.getsize('data/messages.json') / 1e6:.1f} MB)")
+    if args.backend == 'sqlite':
+        started = time.perf_counter()
+        storage.import_json('data/messages.json', 'data/messages.db')
+        print(f"Imported into SQLite in {time.perf_counter() - started:.1f} s")
+
+    import bot
+    client = Client(bot)
+    rng = random.Random(args.seed)
+
+    started = time.perf_counter()
+    bot.store.load()
+    bot.store.aggregates()
+    print(f"Cold load: {time.perf_counter() - started:.2f} s")
+
+    report('view_reviews', [client.timed([client.message(1, 'View reviews')]) for _ in range(args.iterations)])
+    pages = max(1, args.reviews // bot.REVIEWS_PER_PAGE)
+    report('browse_page', [client.timed([client.callback(1, f"reviews_page_{rng.randrange(pages)}_all")]) for _ in range(args.iterations)])
+    report('browse_position', [client.timed([client.callback(1, f"reviews_page_0_{rng.randrange(len(bot.POSITIONS))}")]) for _ in range(args.iterations)])
+    report('display_review', [client.timed([client.callback(1, f"review_{rng.randint(1, args.reviews)}")]) for _ in range(args.iterations)])
+    report('summary', [client.timed([client.message(1, 'View overall summary')]) for _ in range(args.iterations)])
+    started = time.perf_counter()
+    bot.review_columns.sync(bot.store)
+    print(f"Columns load: {time.perf_counter() - started:.2f} s")
+    report('by_position', [client.timed([client.message(1, 'By position')]) for _ in range(args.iterations)])
+    report('distributions', [client.timed([client.message(1, 'Rating distributions')]) for _ in range(args.iterations)])
+    report('trend', [client.timed([client.message(1, 'Last 30 days')]) for _ in range(args.iterations)])
+    started = time.perf_counter()
+    bot.search_index.sync(bot.store)
+    print(f"Search index build: {time.perf_counter() - started:.2f} s")
+    report('search', [client.timed([client.message(1, f"/search {rng.choice(WORDS)} {rng.choice(WORDS)}")]) for _ in range(args.iterations)])
+
+    # Сохранение: время последнего ответа анкеты, после которого отзыв пишется в хранилище
+    save_samples = []
+    for user_id in range(10, 10 + args.iterations):
+        updates = client.review_updates(user_id)
+        client.process(updates[:-1])
+        save_samples.append(client.timed(updates[-1:]))
+    report('save_review', save_samples)
+
+    # Параллельные пользователи: все отзывы отправляются одной пачкой вперемешку
+    batches = [client.review_updates(user_id) for user_id in range(100000, 100000 + args.concurrency)]
+    updates = [update for group in itertools.zip_longest(*batches) for update in group if update is not None]
+    elapsed = client.timed(updates)
+    print(f"{'concurrent_reviews':<22} {args.concurrency:>7} users {len(updates) / elapsed:>10.1f} updates/s "
+          f"total {elapsed:.2f} s")
+
+    print("Outgoing calls:", ', '.join(f"{name}={count}" for name, count in sorted(transport.calls.items())))
+    if not bot.store.verify_aggregates():
+        print("WARNING: aggregates do not match stored reviews")
+
+
+if __name__ == '__main__':
+    main()
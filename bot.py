@@ -1,471 +1,646 @@
-import telebot
+import time
+# Start of the process, for the startup phase timings
+STARTED_AT = time.perf_counter()
 from telebot import types
-import json
+from datetime import datetime, timezone
+import logging
 import os
+import re
+import shlex
+import signal
+import tempfile
+import threading
+import analytics
+import cluster
+import dispatch
+import export
+import keyboards
+import metrics
+import outbound
+import search
+import sessions
+import storage
+from questionnaire import FIRST_STEP, POSITIONS, QUESTIONNAIRE, RATING_CRITERIA
+
+logger = logging.getLogger(__name__)
 
 # Создаем экземпляр бота
 TOKEN = os.getenv('API_TOKEN')
-bot = telebot.TeleBot(TOKEN)
+# Обновления разных пользователей обрабатываются параллельно, одного - по порядку
+bot = dispatch.OrderedTeleBot(TOKEN)
+# Все исходящие запросы идут через очередь с учетом лимитов Telegram
+sender = outbound.OutboundSender(bot)
 DATA_FILE = './data/messages.json'  # Укажите полный путь к файлу, если необходимо
 
-# Create dictionaries to store user states and temporary data
-user_states = {}
-user_data = {}
-
-# Define the list of positions
-POSITIONS = [
-    'Product Manager',
-    'Tracker/Project Manager',
-    'Content Creator',
-    'Marketer',
-    'Frontend Developer',
-    'Backend Developer',
-    'DevOps Engineer',
-    'Psychologist',
-    'Designer',
-    'Data Scientist',
-    'Fundraising Manager'
-]
+# Text of the review buttons used by older versions of the bot
+REVIEW_BUTTON_RE = re.compile(r"Review (\d+) from (.+)")
+
+# Number of reviews shown on one page of the review browser
+REVIEWS_PER_PAGE = 10
+# Callback data of the review browser: page and position index ('all' for no filter)
+REVIEWS_PAGE_RE = re.compile(r"reviews_page_(\d+)_(all|\d+)")
+
+# getUpdates long polling timeout. On SIGTERM polling stops after the current
+# call, then queued updates and replies get SHUTDOWN_TIMEOUT seconds; both
+# together stay within stop_grace_period (30 s) in docker-compose.yml
+POLLING_TIMEOUT = 10
+SHUTDOWN_TIMEOUT = 15
+
+# MULTI_INSTANCE=1: several replicas share the SQLite storage and sessions,
+# only the holder of the lease in DB_FILE polls Telegram (see cluster.py)
+MULTI_INSTANCE = os.getenv('MULTI_INSTANCE', '0') == '1'
+
+# Conversation state of users filling in a review (step + answers so far)
+# SESSION_DB keeps unfinished reviews across restarts; empty means memory only
+SESSION_DB = os.getenv('SESSION_DB', './data/sessions.db')
+user_sessions = sessions.SessionStore(SESSION_DB or None, shared=MULTI_INSTANCE)
 
 # Function to get the main keyboard
-# Функция для получения основной клавиатуры
+# Функция для получения основной клавиатуры (строится один раз)
 def get_main_keyboard():
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    button_write = types.KeyboardButton('Write a review')
-    button_read = types.KeyboardButton('Read reviews')
-    markup.add(button_write, button_read)
-    return markup
+    return keyboards.MAIN_KEYBOARD
 
-# Функция для создания клавиатуры с цифрами от 1 до 5 в одном ряду
+# Функция для получения клавиатуры с цифрами от 1 до 5 в одном ряду
 def get_rating_keyboard():
-    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-    buttons = [types.KeyboardButton(str(i)) for i in range(1, 6)]
-    markup.row(*buttons)  # Располагаем все кнопки в одном ряду
-    return markup
+    return keyboards.RATING_KEYBOARD
+
+# Inline keyboards for position selection, memoized by selection bitmask
+position_keyboards = keyboards.PositionKeyboards(POSITIONS)
+# Position filter of the review browser
+POSITION_FILTER_KEYBOARD = keyboards.freeze(keyboards.build_position_filter_keyboard(POSITIONS))
+
+# Хранилище отзывов: 'json' (снимок DATA_FILE + журнал) или 'sqlite' (DB_FILE)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'json')
+DB_FILE = os.getenv('DB_FILE', './data/messages.db')
+store = storage.create_storage(STORAGE_BACKEND, DATA_FILE, DB_FILE)
+metrics.instrument_methods(store, [
+    'load', 'save', 'append_review', 'compact', 'aggregates',
+    'get_user', 'get_review', 'find_users', 'review_refs',
+])
+
+# Columnar copy of the reviews for the analytics options, loaded on first use
+review_columns = analytics.ReviewColumns(POSITIONS, RATING_CRITERIA)
+# Trailing period of the trend report, days
+TREND_DAYS = 30
+
+# Full-text index of the free-text answers, kept next to the review data.
+# With MULTI_INSTANCE every replica keeps its own index (each catches up with
+# the shared storage on its own) under a slot number that survives restarts.
+def default_search_index_file():
+    base = os.path.splitext(DB_FILE if STORAGE_BACKEND == 'sqlite' else DATA_FILE)[0]
+    if not MULTI_INSTANCE:
+        return base + '.search.json'
+    os.makedirs(os.path.dirname(base) or '.', exist_ok=True)
+    prefix = base + '.search-'
+    slot = cluster.claim_slot(prefix)
+    cluster.remove_stale_files(prefix)
+    return f'{prefix}{slot}.json'
+
+SEARCH_INDEX_FILE = os.getenv('SEARCH_INDEX_FILE') or default_search_index_file()
+search_index = search.SearchIndex(SEARCH_INDEX_FILE)
+# Number of matches shown on one page of search results
+SEARCH_RESULTS_PER_PAGE = 5
+# Length of the answer excerpt on a search result button
+SEARCH_SNIPPET_LENGTH = 40
+# Callback data of search result navigation
+SEARCH_PAGE_RE = re.compile(r"search_page_(\d+)")
+
+# Администраторы (Telegram user id через запятую), которым доступен /export
+ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()}
+# Больше этого Telegram не принимает документы от ботов
+MAX_DOCUMENT_SIZE = 50 * 1024 * 1024
+EXPORT_USAGE = (
+    "Usage: /export [csv|jsonl] [summary] [position=\"Backend Developer\"] "
+    "[since=YYYY-MM-DD] [until=YYYY-MM-DD]"
+)
 
 # Функция инициализации файла данных
 def init_data_file():
-    if not os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'w') as f:
-            json.dump({}, f)
-        print("Data file created.")
-
-# Функция загрузки сообщений из файла
-def load_messages():
-    if not os.path.exists(DATA_FILE):
-        init_data_file()  # Создаем файл, если он не существует
-    try:
-        with open(DATA_FILE, 'r') as f:
-            content = f.read().strip()
-            if not content:
-                # Файл пустой, инициализируем пустым словарем
-                data = {}
-                save_messages(data)
-            else:
-                data = json.loads(content)
-            return data
-    except json.JSONDecodeError as e:
-        print(f"JSON loading error: {e}")
-        # Переинициализируем файл пустым словарем
-        data = {}
-        save_messages(data)
-        return data
-
-# Функция сохранения сообщений в файл
-def save_messages(data):
-    try:
-        with open(DATA_FILE, 'w') as f:
-            json.dump(data, f, indent=4)
-    except IOError as e:
-        print(f"I/O error: {e}")
-    except Exception as e:
-        print(f"Unknown error: {e}")
+    store.init()
 
 # Обработчик команды /start
 @bot.message_handler(commands=['start'])
 def start_bot(message):
     first_msg = f"Hello {message.from_user.first_name} {message.from_user.last_name}!\nThis is an employee review bot. Please choose an option:"
     markup = get_main_keyboard()
-    bot.send_message(message.chat.id, first_msg, reply_markup=markup)
+    sender.send_message(message.chat.id, first_msg, reply_markup=markup)
+
+# Разбор аргументов /export: формат, 'summary' и фильтры key=value
+def parse_export_args(text):
+    options = {'fmt': 'csv', 'summary': False, 'position': None, 'since': None, 'until': None}
+    for token in shlex.split(text)[1:]:
+        key, _, value = token.partition('=')
+        if token in export.FORMATS:
+            options['fmt'] = token
+        elif token == 'summary':
+            options['summary'] = True
+        elif key == 'position' and value in POSITIONS:
+            options['position'] = value
+        elif key == 'position' and value.isdigit() and int(value) < len(POSITIONS):
+            options['position'] = POSITIONS[int(value)]
+        elif key == 'since':
+            options['since'] = export.parse_date(value)
+        elif key == 'until':
+            options['until'] = export.parse_date(value, end=True)
+        else:
+            raise ValueError(f"Unknown export option: {token}")
+    return options
+
+# Admin-only export of reviews or the summary as a CSV/JSONL document.
+# The file is streamed to a temporary file on disk and closed once sent.
+@bot.message_handler(commands=['export'])
+def handle_export(message):
+    if message.from_user.id not in ADMIN_IDS:
+        sender.send_message(message.chat.id, "This command is available to administrators only.")
+        return
+    try:
+        options = parse_export_args(message.text)
+    except ValueError:
+        sender.send_message(message.chat.id, EXPORT_USAGE)
+        return
+    f = tempfile.TemporaryFile()
+    try:
+        if options['summary']:
+            size = export.export_summary(store, f, options['fmt'])
+        else:
+            size = export.export_reviews(store, f, options['fmt'], options['position'], options['since'], options['until'])
+    except Exception as e:
+        f.close()
+        logger.exception("Error exporting reviews: %s", e)
+        sender.send_message(message.chat.id, "An error occurred while exporting the reviews.")
+        return
+    if size > MAX_DOCUMENT_SIZE:
+        f.close()
+        sender.send_message(message.chat.id, "The export is too large to send. Please narrow it down with position, since or until.")
+        return
+    name = 'summary' if options['summary'] else 'reviews'
+    file_name = f"{name}-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}.{options['fmt']}"
+    sender.send_document(message.chat.id, f, on_done=f.close, visible_file_name=file_name)
+
+# Search the free-text answers: /search <terms>
+# The query is kept in the session so the result pages can be flipped
+@bot.message_handler(commands=['search'])
+def handle_search(message):
+    query = message.text.partition(' ')[2].strip()
+    if not query:
+        sender.send_message(message.chat.id, "Usage: /search <words>, e.g. /search mentor опыт")
+        return
+    session = user_sessions.get(message.from_user.id)
+    session.data['search_query'] = query
+    user_sessions.save(session)
+    text, markup = build_search_page(query, 0)
+    sender.send_message(message.chat.id, text, reply_markup=markup)
+
+# Function to build one page of search results
+def build_search_page(query, page):
+    results = search_index.sync(store).search(query)
+    pages = max(1, (len(results) + SEARCH_RESULTS_PER_PAGE - 1) // SEARCH_RESULTS_PER_PAGE)
+    page = min(max(page, 0), pages - 1)
+    if not results:
+        return f"Nothing found for \"{query}\".", None
+
+    markup = types.InlineKeyboardMarkup()
+    for review_id in results[page * SEARCH_RESULTS_PER_PAGE:(page + 1) * SEARCH_RESULTS_PER_PAGE]:
+        user_info, review_number = store.get_review(review_id)
+        review = user_info['reviews'][review_number]
+        answer = review.get('experience_description') or review.get('professional_development_effect') or ''
+        snippet = answer if len(answer) <= SEARCH_SNIPPET_LENGTH else answer[:SEARCH_SNIPPET_LENGTH - 1] + '…'
+        markup.add(types.InlineKeyboardButton(f"{user_info['name']}: {snippet}", callback_data=f"review_{review_id}"))
+    navigation = []
+    if page > 0:
+        navigation.append(types.InlineKeyboardButton("« Prev", callback_data=f"search_page_{page - 1}"))
+    if page < pages - 1:
+        navigation.append(types.InlineKeyboardButton("Next »", callback_data=f"search_page_{page + 1}"))
+    if navigation:
+        markup.row(*navigation)
+    return f"Results for \"{query}\" (page {page + 1}/{pages}). Select a review to read:", markup
+
+# Handle search result navigation
+@bot.callback_query_handler(func=lambda call: call.data.startswith('search_page_'))
+def handle_search_page(call):
+    match = SEARCH_PAGE_RE.fullmatch(call.data)
+    if match is None:
+        # Forged callback data
+        sender.answer_callback_query(call.id)
+        return
+    query = user_sessions.get(call.from_user.id).data.get('search_query')
+    if query:
+        text, markup = build_search_page(query, int(match[1]))
+        sender.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
+        sender.answer_callback_query(call.id)
+    else:
+        sender.answer_callback_query(call.id, "This search has expired, please run /search again.")
 
 # Handle main menu buttons
 @bot.message_handler(func=lambda message: message.text in ['Write a review', 'Read reviews'])
 def handle_buttons(message):
-    global user_states, user_data
     user_id = message.from_user.id
 
     # Reset user state and data
-    user_states[user_id] = None
-    user_data[user_id] = {}
+    user_sessions.reset(user_id)
 
     if message.text == 'Write a review':
         # Start the review process
-        user_data[user_id]['review'] = {}
-        user_states[user_id] = 'awaiting_position_selection'
-        send_positions_keyboard(message.chat.id, user_id)
+        session = user_sessions.get(user_id)
+        session.data['review'] = {}
+        ask_step(message.chat.id, session, FIRST_STEP)
     elif message.text == 'Read reviews':
         # Offer new options
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        button_view_reviews = types.KeyboardButton('View reviews')
-        button_view_summary = types.KeyboardButton('View overall summary')
-        back_button = types.KeyboardButton('Back to main menu')
-        markup.add(button_view_reviews, button_view_summary)
-        markup.add(back_button)
-        bot.send_message(message.chat.id, "Please choose an option:", reply_markup=markup)
+        sender.send_message(message.chat.id, "Please choose an option:", reply_markup=keyboards.READ_MENU_KEYBOARD)
+
+# Options of the 'Read reviews' menu
+READ_OPTIONS = ['View reviews', 'View overall summary', 'By position', 'Rating distributions', 'Last 30 days']
 
 # Handle options after 'Read reviews'
-@bot.message_handler(func=lambda message: message.text in ['View reviews', 'View overall summary'])
+@bot.message_handler(func=lambda message: message.text in READ_OPTIONS)
 def handle_read_reviews_options(message):
     if message.text == 'View reviews':
         show_reviews(message.chat.id)
     elif message.text == 'View overall summary':
         show_overall_summary(message.chat.id)
+    elif message.text == 'By position':
+        show_position_breakdown(message.chat.id)
+    elif message.text == 'Rating distributions':
+        show_rating_distributions(message.chat.id)
+    elif message.text == 'Last 30 days':
+        show_trend(message.chat.id)
 
 # Function to send positions keyboard
-def send_positions_keyboard(chat_id, user_id):
-    markup = types.InlineKeyboardMarkup()
-    user_positions = user_data[user_id].get('positions', [])
-    for position in POSITIONS:
-        if position in user_positions:
-            button_text = f"✅ {position}"
-        else:
-            button_text = position
-        callback_data = f"toggle_position_{position}"
-        button = types.InlineKeyboardButton(button_text, callback_data=callback_data)
-        markup.add(button)
-    # Add 'Done' button
-    done_button = types.InlineKeyboardButton("Done", callback_data="positions_done")
-    markup.add(done_button)
-    bot.send_message(chat_id, "1. Please select the position(s) you interned for. You can select multiple positions.", reply_markup=markup)
+def send_positions_keyboard(chat_id, session):
+    markup = position_keyboards.markup(session.data.get('positions_mask', 0))
+    sender.send_message(chat_id, FIRST_STEP.prompt, reply_markup=markup)
 
 # Handle position selection callbacks
 @bot.callback_query_handler(func=lambda call: call.data.startswith('toggle_position_') or call.data == 'positions_done')
 def handle_position_selection(call):
-    user_id = call.from_user.id
-    state = user_states.get(user_id)
-    if state != 'awaiting_position_selection':
-        bot.answer_callback_query(call.id)
+    session = user_sessions.get(call.from_user.id)
+    step = QUESTIONNAIRE.get(session.state)
+    if step is None or step.kind != 'positions':
+        sender.answer_callback_query(call.id)
         return
 
+    mask = session.data.get('positions_mask', 0) & position_keyboards.full_mask
     if call.data == 'positions_done':
-        positions = user_data[user_id].get('positions', [])
-        if positions:
-            bot.send_message(call.message.chat.id, f"You have selected: {', '.join(positions)}")
+        if mask:
+            sender.send_message(call.message.chat.id, f"You have selected: {', '.join(position_keyboards.selected(mask))}")
             # Proceed to next question
-            user_states[user_id] = 'awaiting_experience_description'
-            bot.send_message(call.message.chat.id, "2. Describe the experience you gained in terms of tasks and skill development.")
+            ask_step(call.message.chat.id, session, step.next)
         else:
-            bot.send_message(call.message.chat.id, "Please select at least one position before proceeding.")
-        bot.answer_callback_query(call.id)
+            sender.send_message(call.message.chat.id, "Please select at least one position before proceeding.")
+        sender.answer_callback_query(call.id)
     else:
-        position = call.data.replace('toggle_position_', '')
-        user_positions = user_data[user_id].get('positions', [])
-        if position in user_positions:
-            user_positions.remove(position)
+        index = position_keyboards.index(call.data.replace('toggle_position_', '', 1))
+        if index is None:
+            sender.answer_callback_query(call.id)
+            return
+        # Flip the position bit and show the memoized keyboard for the new selection
+        mask ^= 1 << index
+        session.data['positions_mask'] = mask
+        user_sessions.save(session)
+        sender.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=position_keyboards.markup(mask))
+        sender.answer_callback_query(call.id)
+
+# Function to format a single review for display
+def format_review(user_info, review_number):
+    review = user_info['reviews'][review_number]
+    positions = ', '.join(review.get('positions', []))
+    multiple_ratings = review.get('multiple_ratings', {})
+    multiple_ratings_text = '\n'.join([f"{key}: {value}/5" for key, value in multiple_ratings.items()])
+    return (
+        f"Review {review_number + 1} from {user_info['name']} {user_info.get('nickname', '')}:\n"
+        f"Positions: {positions}\n"
+        f"2. Experience Description:\n{review.get('experience_description', '')}\n"
+        f"3. Satisfaction with Experience: {review.get('satisfaction_rating', '')}/5\n"
+        f"4. Team Interaction Processes: {review.get('interaction_process_rating', '')}/5\n"
+        f"5. Additional Ratings:\n{multiple_ratings_text}\n"
+        f"6. Professional Development Effect:\n{review.get('professional_development_effect', '')}\n"
+        f"7. Overall Satisfaction: {review.get('overall_satisfaction', '')}/5"
+    )
+
+# Handle review selection from the browser
+@bot.callback_query_handler(func=lambda call: call.data.startswith('review_'))
+def handle_review_callback(call):
+    try:
+        found = store.get_review(int(call.data[len('review_'):]))
+        if found:
+            user_info, review_number = found
+            sender.send_message(call.message.chat.id, format_review(user_info, review_number))
         else:
-            user_positions.append(position)
-        user_data[user_id]['positions'] = user_positions
-        # Update the keyboard
-        markup = types.InlineKeyboardMarkup()
-        for pos in POSITIONS:
-            if pos in user_positions:
-                button_text = f"✅ {pos}"
-            else:
-                button_text = pos
-            callback_data = f"toggle_position_{pos}"
-            button = types.InlineKeyboardButton(button_text, callback_data=callback_data)
-            markup.add(button)
-        # Add 'Done' button
-        done_button = types.InlineKeyboardButton("Done", callback_data="positions_done")
-        markup.add(done_button)
-        bot.edit_message_reply_markup(chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
-        bot.answer_callback_query(call.id)
+            sender.send_message(call.message.chat.id, "Review not found.")
+    except Exception as e:
+        logger.exception("Error displaying review: %s", e)
+        sender.send_message(call.message.chat.id, "An error occurred while trying to display the review.")
+    sender.answer_callback_query(call.id)
 
+# Handle 'Review N from Name' buttons left over from the old reply keyboard
 @bot.message_handler(func=lambda message: message.text.startswith('Review'))
 def display_review(message):
     text = message.text.strip()
     try:
-        import re
-        match = re.match(r"Review (\d+) from (.+)", text)
+        match = REVIEW_BUTTON_RE.match(text)
         if match:
             review_number = int(match.group(1)) - 1  # Преобразуем в индекс
-            user_name = match.group(2)
-            reviews = load_messages()
-            user_id_found = None
-            for uid, data in reviews.items():
-                if data['name'] == user_name:
-                    user_id_found = uid
-                    break
-            if user_id_found:
-                user_info = reviews[user_id_found]
-                user_reviews = user_info.get('reviews', [])
-                if 0 <= review_number < len(user_reviews):
-                    review = user_reviews[review_number]
-                    positions = ', '.join(review.get('positions', []))
-                    multiple_ratings = review.get('multiple_ratings', {})
-                    multiple_ratings_text = '\n'.join([f"{key}: {value}/5" for key, value in multiple_ratings.items()])
-                    review_message = (
-                        f"Review {review_number + 1} from {user_info['name']} {user_info.get('nickname', '')}:\n"
-                        f"Positions: {positions}\n"
-                        f"2. Experience Description:\n{review.get('experience_description', '')}\n"
-                        f"3. Satisfaction with Experience: {review.get('satisfaction_rating', '')}/5\n"
-                        f"4. Team Interaction Processes: {review.get('interaction_process_rating', '')}/5\n"
-                        f"5. Additional Ratings:\n{multiple_ratings_text}\n"
-                        f"6. Professional Development Effect:\n{review.get('professional_development_effect', '')}\n"
-                        f"7. Overall Satisfaction: {review.get('overall_satisfaction', '')}/5"
-                    )
-                    bot.send_message(message.chat.id, review_message, reply_markup=get_main_keyboard())
+            user_ids = store.find_users(match.group(2))
+            if len(user_ids) == 1:
+                user_info = store.get_user(user_ids[0])
+                if 0 <= review_number < len(user_info.get('reviews', [])):
+                    review_message = format_review(user_info, review_number)
+                    sender.send_message(message.chat.id, review_message, reply_markup=get_main_keyboard())
                 else:
-                    bot.send_message(message.chat.id, "Review not found.", reply_markup=get_main_keyboard())
+                    sender.send_message(message.chat.id, "Review not found.", reply_markup=get_main_keyboard())
+            elif user_ids:
+                sender.send_message(message.chat.id, "Several users share this name, please open the review from 'View reviews'.", reply_markup=get_main_keyboard())
             else:
-                bot.send_message(message.chat.id, "User not found.", reply_markup=get_main_keyboard())
+                sender.send_message(message.chat.id, "User not found.", reply_markup=get_main_keyboard())
         else:
-            bot.send_message(message.chat.id, "Invalid review selection.", reply_markup=get_main_keyboard())
+            sender.send_message(message.chat.id, "Invalid review selection.", reply_markup=get_main_keyboard())
     except Exception as e:
-        print(f"Error displaying review: {e}")
-        bot.send_message(message.chat.id, "An error occurred while trying to display the review.", reply_markup=get_main_keyboard())
-
-# Handle multiple ratings (placed before handle_text_messages)
-@bot.message_handler(func=lambda message: user_states.get(message.from_user.id) == 'awaiting_multiple_ratings')
-def handle_multiple_ratings(message):
-    user_id = message.from_user.id
-    text = message.text.strip()
-    ratings = user_data[user_id].get('ratings_list', [])
-    index = user_data[user_id].get('rating_index', 0)
-
-    if validate_rating(text):
-        key = ratings[index]
-        user_data[user_id]['multiple_ratings'][key] = int(text)
-        index += 1
-        if index < len(ratings):
-            user_data[user_id]['rating_index'] = index
-            bot.send_message(
-                message.chat.id,
-                f"{ratings[index]}:",
-                reply_markup=get_rating_keyboard()
-            )
-        else:
-            # Proceed to next question
-            user_data[user_id]['review']['multiple_ratings'] = user_data[user_id]['multiple_ratings']
-            user_states[user_id] = 'awaiting_professional_development_effect'
-            bot.send_message(message.chat.id, "6. What effect did the internship have on your professional development?")
-    else:
-        bot.send_message(message.chat.id, "Please enter a valid rating between 1 and 5.", reply_markup=get_rating_keyboard())
-
+        logger.exception("Error displaying review: %s", e)
+        sender.send_message(message.chat.id, "An error occurred while trying to display the review.", reply_markup=get_main_keyboard())
 
 # Handle text messages
 @bot.message_handler(func=lambda message: True)
 def handle_text_messages(message):
-    global user_states, user_data
     user_id = message.from_user.id
     text = message.text.strip()
 
     # If user wants to return to main menu
     if text == 'Back to main menu':
         # Reset user state and data
-        user_states[user_id] = None
-        user_data[user_id] = {}
-        bot.send_message(message.chat.id, "Returned to the main menu.", reply_markup=get_main_keyboard())
+        user_sessions.reset(user_id)
+        sender.send_message(message.chat.id, "Returned to the main menu.", reply_markup=get_main_keyboard())
         return
 
     # Get user state
-    state = user_states.get(user_id)
-
-    if state == 'awaiting_experience_description':
-        user_data[user_id]['review']['experience_description'] = text
-        user_states[user_id] = 'awaiting_satisfaction_rating'
-        bot.send_message(
-            message.chat.id,
-            "3. How satisfied are you with the experience gained? Rate on a scale of 1-5 (where 1 - not satisfied at all, there was nothing useful, 5 - the experience I received completely met or exceeded my expectations).",
-            reply_markup=get_rating_keyboard()
-        )
-    elif state == 'awaiting_satisfaction_rating':
-        if validate_rating(text):
-            user_data[user_id]['review']['satisfaction_rating'] = int(text)
-            user_states[user_id] = 'awaiting_interaction_process_rating'
-            bot.send_message(
-                message.chat.id,
-                "4. How well are the interaction processes built in the team? Rate on a scale of 1-5 (where 1 is very bad, nothing clear, 5 is very good and clear).",
-                reply_markup=get_rating_keyboard()
-            )
-        else:
-            bot.send_message(
-                message.chat.id,
-                "Please enter a valid rating between 1 and 5.",
-                reply_markup=get_rating_keyboard()
-            )
-    elif state == 'awaiting_interaction_process_rating':
-        if validate_rating(text):
-            user_data[user_id]['review']['interaction_process_rating'] = int(text)
-            # Proceed to multiple ratings
-            ask_multiple_ratings(message.chat.id, user_id)
-        else:
-            bot.send_message(
-                message.chat.id,
-                "Please enter a valid rating between 1 and 5.",
-                reply_markup=get_rating_keyboard()
-            )
-    elif state == 'awaiting_professional_development_effect':
-        user_data[user_id]['review']['professional_development_effect'] = text
-        user_states[user_id] = 'awaiting_overall_satisfaction_rating'
-        bot.send_message(
-            message.chat.id,
-            "7. Overall satisfaction with the internship on a scale of 1-5 (where 1- not satisfied at all, 5 - fully satisfied).",
-            reply_markup=get_rating_keyboard()
-        )
-    elif state == 'awaiting_overall_satisfaction_rating':
-        if validate_rating(text):
-            user_data[user_id]['review']['overall_satisfaction'] = int(text)
+    session = user_sessions.get(user_id)
+    step = QUESTIONNAIRE.get(session.state)
+
+    if step is not None and step.kind != 'positions':
+        value, error = step.parse(text)
+        if error:
+            sender.send_message(message.chat.id, error, reply_markup=step.keyboard)
+            return
+        step.store(session.data['review'], value)
+        if step.next is None:
             # Save the review
-            save_review(user_id, message)
+            save_review(session, message)
         else:
-            bot.send_message(
-                message.chat.id,
-                "Please enter a valid rating between 1 and 5.",
-                reply_markup=get_rating_keyboard()
-            )
+            ask_step(message.chat.id, session, step.next)
     else:
         # Prompt user to use the buttons
-        bot.send_message(message.chat.id, "Please use the buttons to interact with the bot.", reply_markup=get_main_keyboard())
+        sender.send_message(message.chat.id, "Please use the buttons to interact with the bot.", reply_markup=get_main_keyboard())
         # Reset user state and data
-        user_states[user_id] = None
-        user_data[user_id] = {}
-
-# Function to validate rating input
-def validate_rating(text):
-    try:
-        rating = int(text)
-        return 1 <= rating <= 5
-    except ValueError:
-        return False
-
-# Function to ask multiple ratings
-def ask_multiple_ratings(chat_id, user_id):
-    user_states[user_id] = 'awaiting_multiple_ratings'
-    user_data[user_id]['multiple_ratings'] = {}
-    # Start with the first rating
-    user_data[user_id]['rating_index'] = 0
-    ratings = [
-        'Working atmosphere in the team',
-        'Convenience of schedule',
-        'Activity of founders',
-        'Activity of the whole team',
-        'Opportunities for self-realization and creativity'
-    ]
-    user_data[user_id]['ratings_list'] = ratings  # Store ratings list in user_data
-    bot.send_message(
-        chat_id,
-        f"5. Rate the following on a scale of 1-5 (where 1 is all very bad, 5 is very good).\n\n{ratings[0]}:",
-        reply_markup=get_rating_keyboard()
-    )
+        user_sessions.reset(user_id)
+
+# Function to move the session to a questionnaire step and ask its question
+def ask_step(chat_id, session, step):
+    session.state = step.state
+    user_sessions.save(session)
+    if step.kind == 'positions':
+        send_positions_keyboard(chat_id, session)
+    else:
+        sender.send_message(chat_id, step.prompt, reply_markup=step.keyboard)
 
 # Function to save the review
-def save_review(user_id, message):
+def save_review(session, message):
+    user_id = session.user_id
     user_name = f"{message.from_user.first_name} {message.from_user.last_name}"
     nickname = f"@{message.from_user.username}" if message.from_user.username else "No username"
-    review_data = user_data[user_id]['review']
-    review_data['positions'] = user_data[user_id].get('positions', [])
-    # Include multiple ratings
-    review_data['multiple_ratings'] = user_data[user_id].get('multiple_ratings', {})
-    # Load existing messages
-    messages = load_messages()
-    if str(user_id) not in messages:
-        messages[str(user_id)] = {'name': user_name, 'nickname': nickname, 'reviews': []}
-    else:
-        # Update nickname if it has changed
-        messages[str(user_id)]['nickname'] = nickname
-    # Add new review
-    messages[str(user_id)]['reviews'].append(review_data)
-    # Save messages
-    save_messages(messages)
+    review_data = session.data['review']
+    review_data['positions'] = position_keyboards.selected(session.data.get('positions_mask', 0))
+    review_data['created_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    # Append the review to the storage log
+    try:
+        store.append_review(user_id, user_name, nickname, review_data)
+        if search_index.loaded:
+            search_index.add(review_data)
+    except Exception as e:
+        logger.exception("Error saving review: %s", e)
+        sender.send_message(message.chat.id, 'Sorry, your review could not be saved. Please try again.', reply_markup=get_rating_keyboard())
+        return
     # Confirmation message
-    bot.send_message(message.chat.id, 'Your review has been saved! Thank you for your feedback.', reply_markup=get_main_keyboard())
-    # Reset user state and data
-    user_states[user_id] = None
-    user_data[user_id] = {}
+    sender.send_message(message.chat.id, 'Your review has been saved! Thank you for your feedback.', reply_markup=get_main_keyboard())
+    # Drop the finished session
+    user_sessions.reset(user_id)
+
+# Function to build one page of the review browser
+# Callback data carries the page and the position index ('all' for no filter)
+def build_reviews_page(page, position_index=None):
+    position = POSITIONS[position_index] if position_index is not None else None
+    refs = store.review_refs(position)
+    pages = max(1, (len(refs) + REVIEWS_PER_PAGE - 1) // REVIEWS_PER_PAGE)
+    page = min(max(page, 0), pages - 1)
+    filter_key = 'all' if position_index is None else str(position_index)
+
+    markup = types.InlineKeyboardMarkup()
+    buttons = []
+    for review_id in refs[page * REVIEWS_PER_PAGE:(page + 1) * REVIEWS_PER_PAGE]:
+        user_info, review_number = store.get_review(review_id)
+        button_text = f"Review {review_number + 1} from {user_info['name']}"
+        buttons.append(types.InlineKeyboardButton(button_text, callback_data=f"review_{review_id}"))
+    # Arrange buttons in rows
+    for i in range(0, len(buttons), 2):
+        markup.row(*buttons[i:i+2])
+    # Navigation row
+    navigation = []
+    if page > 0:
+        navigation.append(types.InlineKeyboardButton("« Prev", callback_data=f"reviews_page_{page - 1}_{filter_key}"))
+    if page < pages - 1:
+        navigation.append(types.InlineKeyboardButton("Next »", callback_data=f"reviews_page_{page + 1}_{filter_key}"))
+    if navigation:
+        markup.row(*navigation)
+    markup.add(types.InlineKeyboardButton("Filter by position", callback_data="reviews_filter"))
+
+    title = f"Reviews for {position}" if position else "All reviews"
+    text = f"{title} (page {page + 1}/{pages}). Select a review to read:"
+    if not refs:
+        text = f"No reviews for {position}." if position else "No reviews available."
+    return text, markup
 
 # Function to display reviews
 def show_reviews(chat_id):
-    reviews = load_messages()
-    if not reviews:
-        bot.send_message(chat_id, "No reviews available.", reply_markup=get_main_keyboard())
-    else:
-        markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
-        buttons = []
-        for user_id_key, user_info in reviews.items():
-            user_name = user_info['name']
-            for i, review in enumerate(user_info.get('reviews', [])):
-                # Include user's name in the button text
-                button_text = f"Review {i + 1} from {user_name}"
-                button = types.KeyboardButton(button_text)
-                buttons.append(button)
-        # Arrange buttons in rows
-        for i in range(0, len(buttons), 2):
-            row_buttons = buttons[i:i+2]
-            markup.row(*row_buttons)
-        # Add 'Back to main menu' button
-        back_button = types.KeyboardButton('Back to main menu')
-        markup.add(back_button)
-        bot.send_message(chat_id, "Select a review to read:", reply_markup=markup)
+    if not store.review_refs():
+        sender.send_message(chat_id, "No reviews available.", reply_markup=get_main_keyboard())
+        return
+    text, markup = build_reviews_page(0)
+    sender.send_message(chat_id, text, reply_markup=markup)
+
+# Handle review browser navigation
+@bot.callback_query_handler(func=lambda call: call.data.startswith('reviews_'))
+def handle_reviews_browser(call):
+    if call.data == 'reviews_filter':
+        # Offer the list of positions to filter by
+        sender.edit_message_text("Choose a position:", chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=POSITION_FILTER_KEYBOARD)
+    elif call.data.startswith('reviews_page_'):
+        match = REVIEWS_PAGE_RE.fullmatch(call.data)
+        position_index = None if match is None or match[2] == 'all' else int(match[2])
+        if match is None or (position_index is not None and position_index >= len(POSITIONS)):
+            # Forged or outdated callback data
+            sender.answer_callback_query(call.id)
+            return
+        text, markup = build_reviews_page(int(match[1]), position_index)
+        sender.edit_message_text(text, chat_id=call.message.chat.id, message_id=call.message.message_id, reply_markup=markup)
+    sender.answer_callback_query(call.id)
 
 # Handle review selection
 
 # Function to show overall summary
+# Averages come from the running aggregates kept by the storage
 def show_overall_summary(chat_id):
-    data = load_messages()
-    # Initialize variables to calculate average ratings
-    total_satisfaction_rating = 0
-    total_interaction_process_rating = 0
-    multiple_ratings_totals = {
-        'Working atmosphere in the team': 0,
-        'Convenience of schedule': 0,
-        'Activity of founders': 0,
-        'Activity of the whole team': 0,
-        'Opportunities for self-realization and creativity': 0
-    }
-    count_satisfaction_rating = 0
-    count_interaction_process_rating = 0
-    counts_multiple_ratings = {key: 0 for key in multiple_ratings_totals}
-
-    # Iterate through all reviews to sum ratings
-    for user_info in data.values():
-        for review in user_info.get('reviews', []):
-            if 'satisfaction_rating' in review:
-                total_satisfaction_rating += review['satisfaction_rating']
-                count_satisfaction_rating += 1
-            if 'interaction_process_rating' in review:
-                total_interaction_process_rating += review['interaction_process_rating']
-                count_interaction_process_rating += 1
-            multiple_ratings = review.get('multiple_ratings', {})
-            for key in multiple_ratings_totals.keys():
-                if key in multiple_ratings:
-                    multiple_ratings_totals[key] += multiple_ratings[key]
-                    counts_multiple_ratings[key] += 1
-
-    # Calculate averages
+    aggregates = store.aggregates()
+
     summary_message = "Overall Summary:\n"
-    if count_satisfaction_rating > 0:
-        avg_satisfaction = total_satisfaction_rating / count_satisfaction_rating
+    avg_satisfaction = aggregates.mean('satisfaction_rating')
+    if avg_satisfaction is not None:
         summary_message += f"Average Satisfaction with Experience: {avg_satisfaction:.2f}/5\n"
     else:
         summary_message += "No data for Satisfaction with Experience\n"
 
-    if count_interaction_process_rating > 0:
-        avg_interaction = total_interaction_process_rating / count_interaction_process_rating
+    avg_interaction = aggregates.mean('interaction_process_rating')
+    if avg_interaction is not None:
         summary_message += f"Average Team Interaction Processes: {avg_interaction:.2f}/5\n"
     else:
         summary_message += "No data for Team Interaction Processes\n"
 
     summary_message += "Average Ratings for Additional Criteria:\n"
-    for key in multiple_ratings_totals.keys():
-        if counts_multiple_ratings[key] > 0:
-            avg = multiple_ratings_totals[key] / counts_multiple_ratings[key]
+    for key in RATING_CRITERIA:
+        avg = aggregates.mean(key)
+        if avg is not None:
             summary_message += f"{key}: {avg:.2f}/5\n"
         else:
             summary_message += f"{key}: No data\n"
 
-    bot.send_message(chat_id, summary_message, reply_markup=get_main_keyboard())
+    if aggregates.positions:
+        summary_message += f"Reviews by Position (total {aggregates.review_count}):\n"
+        for position in POSITIONS:
+            if position in aggregates.positions:
+                summary_message += f"{position}: {aggregates.positions[position]}\n"
+
+    sender.send_message(chat_id, summary_message, reply_markup=get_main_keyboard())
+
+def format_mean(value):
+    return f"{value:.2f}/5" if value is not None else "no data"
+
+def format_histogram(histogram):
+    return ' '.join(f"{rating}★×{count}" for rating, count in enumerate(histogram, start=1))
+
+# Overall satisfaction broken down by position
+def show_position_breakdown(chat_id):
+    breakdown = review_columns.sync(store).position_breakdown('overall_satisfaction')
+    if not breakdown:
+        sender.send_message(chat_id, "No reviews yet.", reply_markup=get_main_keyboard())
+        return
+    summary_message = "Overall Satisfaction by Position:\n"
+    for position, count, stats in breakdown:
+        summary_message += (
+            f"{position} ({count} reviews): average {format_mean(stats['mean'])}, "
+            f"median {format_mean(stats['median'])}\n"
+        )
+    sender.send_message(chat_id, summary_message, reply_markup=get_main_keyboard())
+
+# Distribution and median of every rating
+def show_rating_distributions(chat_id):
+    distributions = review_columns.sync(store).distributions()
+    summary_message = "Rating Distributions:\n"
+    for field, label in [('satisfaction_rating', 'Satisfaction with Experience'),
+                         ('interaction_process_rating', 'Team Interaction Processes'),
+                         ('overall_satisfaction', 'Overall Satisfaction')] + [(key, key) for key in RATING_CRITERIA]:
+        stats = distributions[field]
+        if stats['count']:
+            summary_message += f"{label}: median {format_mean(stats['median'])}\n{format_histogram(stats['histogram'])}\n"
+        else:
+            summary_message += f"{label}: No data\n"
+    sender.send_message(chat_id, summary_message, reply_markup=get_main_keyboard())
+
+# Overall satisfaction over the trailing TREND_DAYS days, week by week
+def show_trend(chat_id):
+    trend = review_columns.sync(store).trend('overall_satisfaction', days=TREND_DAYS)
+    current, previous = trend['current'], trend['previous']
+    summary_message = (
+        f"Last {TREND_DAYS} days: {current['count']} reviews, "
+        f"average Overall Satisfaction {format_mean(current['mean'])}\n"
+        f"Previous {TREND_DAYS} days: {previous['count']} reviews, average {format_mean(previous['mean'])}\n"
+    )
+    if current['mean'] is not None and previous['mean'] is not None:
+        summary_message += f"Change: {current['mean'] - previous['mean']:+.2f}\n"
+    summary_message += "By week (most recent first):\n"
+    for start, end, count, mean in trend['buckets']:
+        summary_message += f"Days {start + 1}-{end} ago: {count} reviews, average {format_mean(mean)}\n"
+    sender.send_message(chat_id, summary_message, reply_markup=get_main_keyboard())
+
+# Time every registered handler and expose runtime gauges
+metrics.instrument_handlers(bot)
+metrics.gauge('tiddle_active_sessions', 'Sessions held in memory.', lambda: len(user_sessions))
+metrics.gauge('tiddle_data_size_bytes', 'Size of the review storage on disk.', store.size_bytes)
+metrics.gauge('tiddle_outbound_queue_depth', 'Requests waiting in the outbound queue.', lambda: sender.queued)
+
+# Load the review index and aggregates in the background so the bot answers
+# right after a restart and the first readers don't pay for parsing the data.
+# /ready on the metrics port turns 200 once this is done; analytics columns
+# and the search index are warmed afterwards, they are optional features.
+# Finishes the updates already taken from Telegram and sends their replies,
+# but gives up after timeout seconds (the rest is lost with the process)
+def drain_queues(timeout):
+    deadline = time.monotonic() + timeout
+    if not bot.workers.join(timeout) or not sender.join(max(0, deadline - time.monotonic())):
+        logger.warning("Stopped with unfinished updates or unsent replies after %.0f s.", timeout)
+
+def warm_up():
+    try:
+        with metrics.startup_phase('review_index'):
+            store.review_refs()
+        with metrics.startup_phase('aggregates'):
+            store.aggregates()
+    except Exception as e:
+        logger.exception("Warm-up failed: %s", e)
+        return
+    metrics.READY.set()
+    metrics.record_startup_phase('ready', time.perf_counter() - STARTED_AT)
+    for name, index in (('analytics', review_columns), ('search_index', search_index)):
+        try:
+            with metrics.startup_phase(name):
+                index.sync(store)
+        except Exception as e:
+            logger.exception("Warm-up of %s failed: %s", name, e)
 
 if __name__ == '__main__':
-    init_data_file()
-    bot.infinity_polling()
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s %(message)s')
+    metrics.record_startup_phase('imports', time.perf_counter() - STARTED_AT)
+    # METRICS_PORT=0 disables the metrics endpoint (and the /health and /ready probes)
+    if metrics.METRICS_PORT:
+        metrics.start_server()
+    if MULTI_INSTANCE and STORAGE_BACKEND != 'sqlite':
+        raise SystemExit("MULTI_INSTANCE=1 needs STORAGE_BACKEND=sqlite on a volume shared by all instances")
+    with metrics.startup_phase('init_storage'):
+        init_data_file()
+    threading.Thread(target=warm_up, name='WarmUp', daemon=True).start()
+    # RUN_MODE: 'polling' (getUpdates) or 'webhook' (HTTP server, see webhook.py)
+    if os.getenv('RUN_MODE', 'polling') == 'webhook':
+        import webhook
+        # Every instance serves webhook requests and registers the same webhook
+        # on start (setWebhook with the same URL is harmless), so any restart
+        # of any instance re-registers it
+        webhook.run_webhook(bot)
+    else:
+        # SIGTERM (docker stop) stops polling so the process finishes the
+        # updates it already took, sends their replies and, with MULTI_INSTANCE,
+        # gives up the polling lease at once instead of leaving the others
+        # waiting LEASE_TTL
+        stopping = threading.Event()
+
+        def handle_sigterm(signum, frame):
+            stopping.set()
+            bot.stop_polling()
+
+        signal.signal(signal.SIGTERM, handle_sigterm)
+        if MULTI_INSTANCE:
+            lease = cluster.Lease(DB_FILE)
+            try:
+                cluster.run_leader_polling(bot, lease, stopping, long_polling_timeout=POLLING_TIMEOUT)
+            finally:
+                drain_queues(SHUTDOWN_TIMEOUT)
+                lease.release(bot.last_update_id)
+        else:
+            bot.remove_webhook()
+            bot.infinity_polling(long_polling_timeout=POLLING_TIMEOUT)
+            drain_queues(SHUTDOWN_TIMEOUT)
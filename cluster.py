@@ -0,0 +1,179 @@
+# Работа нескольких экземпляров бота на общих данных. Хранилище и сессии
+# лежат в общей базе SQLite (том, общий для контейнеров одной машины), а
+# опрашивать Telegram (getUpdates) может только держатель аренды (lease) в
+# той же базе. Держатель продлевает аренду каждые
+# LEASE_TTL/3 секунд; если он упал или завис, аренду через LEASE_TTL
+# забирает другой экземпляр. Вместе с арендой хранится последний
+# обработанный update_id, чтобы новый лидер продолжил с того же места.
+import glob
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import storage
+
+INSTANCE_ID = os.getenv('INSTANCE_ID') or f"{socket.gethostname()}-{os.getpid()}"
+# Срок аренды, секунды
+LEASE_TTL = float(os.getenv('LEASE_TTL', '30'))
+
+LEASE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    holder TEXT NOT NULL,
+    expires REAL NOT NULL,
+    update_offset INTEGER NOT NULL DEFAULT 0
+)
+"""
+
+logger = logging.getLogger(__name__)
+
+# Файлы блокировок занятых номеров, открыты до выхода процесса
+_slot_locks = []
+
+
+class Lease:
+    def __init__(self, db_file, name='poller', holder=INSTANCE_ID, ttl=LEASE_TTL):
+        self.db_file = db_file
+        self.name = name
+        self.holder = holder
+        self.ttl = ttl
+        self._local = threading.local()
+
+    def _connection(self):
+        # Транзакции открываем сами (BEGIN IMMEDIATE)
+        return storage.thread_connection(
+            self._local, self.db_file, lambda conn: conn.execute(LEASE_SCHEMA), isolation_level=None
+        )
+
+    # Берет или продлевает аренду. Возвращает True, если она наша.
+    # update_offset, если задан, сохраняется вместе с арендой.
+    def acquire(self, update_offset=None):
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute("SELECT holder, expires FROM leases WHERE name = ?", (self.name,)).fetchone()
+            if row is not None and row[0] != self.holder and row[1] > now:
+                conn.execute('ROLLBACK')
+                return False
+            conn.execute(
+                "INSERT INTO leases (name, holder, expires) VALUES (?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires = excluded.expires",
+                (self.name, self.holder, now + self.ttl)
+            )
+            if update_offset is not None:
+                conn.execute(
+                    "UPDATE leases SET update_offset = MAX(update_offset, ?) WHERE name = ?", (update_offset, self.name)
+                )
+            conn.execute('COMMIT')
+            return True
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    # Отдает аренду сразу, не дожидаясь истечения срока. update_offset, если
+    # задан, сохраняется, чтобы следующий лидер не получил эти обновления снова.
+    def release(self, update_offset=None):
+        conn = self._connection()
+        conn.execute(
+            "UPDATE leases SET expires = 0, update_offset = MAX(update_offset, COALESCE(?, 0)) "
+            "WHERE name = ? AND holder = ?",
+            (update_offset, self.name, self.holder)
+        )
+
+    def update_offset(self):
+        row = self._connection().execute("SELECT update_offset FROM leases WHERE name = ?", (self.name,)).fetchone()
+        return row[0] if row else 0
+
+    def holder_id(self):
+        row = self._connection().execute(
+            "SELECT holder FROM leases WHERE name = ? AND expires > ?", (self.name, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+
+# Постоянный номер экземпляра среди работающих с одним томом: первый n, для
+# которого удалось заблокировать <prefix><n>.lock. Блокировка держится до
+# выхода процесса, и после перезапуска освободившийся номер получает новый
+# экземпляр, поэтому файлы с номером (например, индекс поиска) переиспользуются,
+# а не копятся с каждым развертыванием, как файлы с именем по INSTANCE_ID.
+def claim_slot(prefix, limit=64):
+    if fcntl is None:
+        raise RuntimeError("Several instances need file locks (fcntl), which this platform does not have")
+    for slot in range(limit):
+        fd = os.open(f"{prefix}{slot}.lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            continue
+        _slot_locks.append(fd)
+        return slot
+    raise RuntimeError(f"All {limit} instance slots for {prefix} are taken")
+
+
+# Удаляет файлы <prefix>*, у которых вместо номера другое имя (остались от
+# версий, называвших файлы по INSTANCE_ID): их больше никто не откроет
+def remove_stale_files(prefix):
+    for path in glob.glob(glob.escape(prefix) + '*'):
+        if not path[len(prefix):].split('.', 1)[0].isdigit():
+            try:
+                os.remove(path)
+                logger.info("Removed stale file %s.", path)
+            except FileNotFoundError:
+                pass
+
+
+# Продлевает аренду, пока идет опрос. Если продлить не удалось, останавливает
+# опрос (и повторяет остановку, пока опрос не завершится).
+def _keep_lease(bot, lease, interval, stopped):
+    while not stopped.wait(interval):
+        try:
+            renewed = lease.acquire(bot.last_update_id)
+        except sqlite3.Error as e:
+            logger.error("Could not renew lease: %s", e)
+            renewed = False
+        if not renewed:
+            logger.warning("Lost the polling lease, stopping polling.")
+            while not stopped.is_set():
+                bot.stop_polling()
+                stopped.wait(1)
+            return
+
+
+# Опрос Telegram только у лидера. Остальные экземпляры ждут и забирают
+# аренду, когда она освобождается или истекает. Выходит, когда установлено
+# stopping (и опрос остановлен через bot.stop_polling()).
+def run_leader_polling(bot, lease, stopping=None, **polling_kwargs):
+    stopping = stopping or threading.Event()
+    interval = lease.ttl / 3
+    standing_by = False
+    while not stopping.is_set():
+        try:
+            acquired = lease.acquire()
+        except sqlite3.Error as e:
+            logger.error("Could not acquire lease: %s", e)
+            acquired = False
+        if not acquired:
+            if not standing_by:
+                logger.info("Instance %s standing by, polling is done by %s.", lease.holder, lease.holder_id())
+                standing_by = True
+            stopping.wait(interval)
+            continue
+        standing_by = False
+        bot.last_update_id = max(bot.last_update_id, lease.update_offset())
+        logger.info("Instance %s holds the polling lease.", lease.holder)
+        stopped = threading.Event()
+        threading.Thread(target=_keep_lease, args=(bot, lease, interval, stopped), name='LeaseKeeper', daemon=True).start()
+        try:
+            bot.remove_webhook()
+            bot.infinity_polling(**polling_kwargs)
+        finally:
+            stopped.set()
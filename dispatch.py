@@ -0,0 +1,75 @@
+import logging
+import os
+import queue
+import threading
+import time
+
+import telebot
+
+# Сколько потоков обрабатывают обновления
+WORKER_THREADS = int(os.getenv('WORKER_THREADS', '8'))
+
+logger = logging.getLogger(__name__)
+
+
+# Пул потоков с очередью на каждый поток. Задачи с одинаковым ключом всегда
+# попадают в одну и ту же очередь и выполняются по порядку, задачи с разными
+# ключами выполняются параллельно.
+class KeyedWorkerPool:
+    def __init__(self, num_workers=WORKER_THREADS):
+        self.queues = [queue.Queue() for _ in range(num_workers)]
+        self.threads = []
+        for i, tasks in enumerate(self.queues):
+            thread = threading.Thread(target=self._run, args=(tasks,), name=f"UpdateWorker-{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _run(self, tasks):
+        while True:
+            task, args = tasks.get()
+            try:
+                task(*args)
+            except Exception as e:
+                logger.exception("Error processing update: %s", e)
+            finally:
+                tasks.task_done()
+
+    def submit(self, key, task, *args):
+        self.queues[hash(key) % len(self.queues)].put((task, args))
+
+    # Ждет, пока все поставленные задачи будут выполнены, но не дольше
+    # timeout секунд. Возвращает False, если время вышло.
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for tasks in self.queues:
+            with tasks.all_tasks_done:
+                while tasks.unfinished_tasks:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    tasks.all_tasks_done.wait(remaining)
+        return True
+
+
+# Ключ упорядочивания: id пользователя, от которого пришло обновление
+def update_user_id(update):
+    for event in (update.message, update.edited_message, update.callback_query):
+        if event is not None and event.from_user is not None:
+            return event.from_user.id
+    return None
+
+
+# TeleBot, который раздает обновления пулу потоков по id пользователя:
+# обновления одного пользователя обрабатываются строго по очереди, а
+# медленный запрос к Telegram для одного пользователя не задерживает других.
+class OrderedTeleBot(telebot.TeleBot):
+    def __init__(self, token, num_workers=WORKER_THREADS, **kwargs):
+        super().__init__(token, threaded=False, **kwargs)
+        self.workers = KeyedWorkerPool(num_workers)
+
+    def process_new_updates(self, updates):
+        for update in updates:
+            # Смещение для getUpdates двигаем сразу, не дожидаясь обработки
+            if update.update_id > self.last_update_id:
+                self.last_update_id = update.update_id
+            self.workers.submit(update_user_id(update), super().process_new_updates, [update])
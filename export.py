@@ -0,0 +1,146 @@
+# Потоковая выгрузка отзывов и сводки в CSV/JSONL.
+# Отзывы читаются из хранилища по одному (iter_reviews), превращаются в строки
+# и кодируются порциями, так что в памяти одновременно лежит только одна
+# порция, а не вся выборка. Используется командой /export и из консоли:
+#   python export.py --format csv --position "Backend Developer" --since 2024-01-01 --output reviews.csv
+#   python export.py --summary --format jsonl
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from datetime import date, timedelta
+
+import storage
+from questionnaire import RATING_CRITERIA
+
+FORMATS = ('csv', 'jsonl')
+# Сколько строк кодируем за раз
+CHUNK_ROWS = 500
+
+REVIEW_FIELDS = [
+    'id', 'user_id', 'name', 'nickname', 'created_at', 'positions',
+    'experience_description', 'satisfaction_rating', 'interaction_process_rating',
+] + RATING_CRITERIA + ['professional_development_effect', 'overall_satisfaction']
+
+SUMMARY_FIELDS = ['section', 'key', 'rating', 'count']
+
+
+# 'YYYY-MM-DD' -> строка для сравнения с created_at. Конец диапазона
+# включает весь день, поэтому сравниваем с началом следующего дня.
+def parse_date(value, end=False):
+    day = date.fromisoformat(value)
+    if end:
+        day += timedelta(days=1)
+    return day.isoformat()
+
+
+def review_row(user_id, name, nickname, review):
+    multiple_ratings = review.get('multiple_ratings', {})
+    row = {
+        'id': review.get('id'),
+        'user_id': user_id,
+        'name': name,
+        'nickname': nickname,
+        'created_at': review.get('created_at'),
+        'positions': '; '.join(review.get('positions', [])),
+    }
+    for field in REVIEW_FIELDS[len(row):]:
+        row[field] = multiple_ratings.get(field) if field in RATING_CRITERIA else review.get(field)
+    return row
+
+
+def review_rows(store, position=None, since=None, until=None):
+    for user_id, name, nickname, review in store.iter_reviews(position, since, until):
+        yield review_row(user_id, name, nickname, review)
+
+
+# Сводка по накопленным счетчикам: сколько раз поставлена каждая оценка
+# по полям и критериям, и число отзывов по позициям
+def summary_rows(aggregates):
+    yield {'section': 'total', 'key': 'reviews', 'rating': None, 'count': aggregates.review_count}
+    for section, counters in (('rating', aggregates.ratings), ('criterion', aggregates.criteria)):
+        for key, counter in counters.items():
+            for rating, count in enumerate(counter['histogram'], start=1):
+                yield {'section': section, 'key': key, 'rating': rating, 'count': count}
+    for position, count in aggregates.positions.items():
+        yield {'section': 'position', 'key': position, 'rating': None, 'count': count}
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# Строки -> порции байтов в выбранном формате (CSV с заголовком или JSONL)
+def encode_chunks(rows, fields, fmt='csv', chunk_rows=CHUNK_ROWS):
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields)
+        writer.writeheader()
+        header = buffer.getvalue()
+        # BOM, чтобы Excel открыл кириллицу в UTF-8
+        yield ('\ufeff' + header).encode('utf-8')
+        for batch in _batches(rows, chunk_rows):
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(batch)
+            yield buffer.getvalue().encode('utf-8')
+    else:
+        for batch in _batches(rows, chunk_rows):
+            yield ''.join(json.dumps(row, ensure_ascii=False) + '\n' for row in batch).encode('utf-8')
+
+
+# Пишет порции в бинарный файл; возвращает число записанных байтов
+def write_chunks(chunks, f):
+    size = 0
+    for chunk in chunks:
+        f.write(chunk)
+        size += len(chunk)
+    return size
+
+
+def export_reviews(store, f, fmt='csv', position=None, since=None, until=None):
+    return write_chunks(encode_chunks(review_rows(store, position, since, until), REVIEW_FIELDS, fmt), f)
+
+
+def export_summary(store, f, fmt='csv'):
+    return write_chunks(encode_chunks(summary_rows(store.aggregates()), SUMMARY_FIELDS, fmt), f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export reviews or the summary as CSV/JSONL.")
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--summary', action='store_true', help="export rating counts instead of reviews")
+    parser.add_argument('--position', help="only reviews for this position")
+    parser.add_argument('--since', type=parse_date, help="first day, YYYY-MM-DD")
+    parser.add_argument('--until', type=lambda value: parse_date(value, end=True), help="last day, YYYY-MM-DD")
+    parser.add_argument('--output', help="output file (default: stdout)")
+    parser.add_argument('--backend', choices=['json', 'sqlite'], default=os.getenv('STORAGE_BACKEND', 'json'))
+    parser.add_argument('--data-file', default='./data/messages.json')
+    parser.add_argument('--db-file', default=os.getenv('DB_FILE', './data/messages.db'))
+    args = parser.parse_args()
+
+    store = storage.create_storage(args.backend, args.data_file, args.db_file)
+    f = open(args.output, 'wb') if args.output else sys.stdout.buffer
+    try:
+        if args.summary:
+            export_summary(store, f, args.format)
+        else:
+            export_reviews(store, f, args.format, args.position, args.since, args.until)
+    finally:
+        if args.output:
+            f.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,215 @@
+# Локальная имитация Bot API для проверки webhook-режима без сети:
+#   python fake_telegram.py
+# Поднимает фейковый api.telegram.org, направляет на него telebot, запускает
+# webhook-сервер бота во временном каталоге и проходит сценарий отзыва.
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self._handle()
+
+    def do_GET(self):
+        self._handle()
+
+    def _handle(self):
+        url = urlsplit(self.path)
+        method_name = url.path.rsplit('/', 1)[-1]
+        params = dict(parse_qsl(url.query))
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Type', '').startswith('application/x-www-form-urlencoded'):
+            params.update(parse_qsl(body.decode('utf-8')))
+        result = self.server.fake.record(method_name, params)
+        payload = json.dumps({'ok': True, 'result': result}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Фейковый Bot API: запоминает все вызовы и отвечает правдоподобными результатами
+class FakeTelegram:
+    def __init__(self, host='127.0.0.1', port=0):
+        self.server = ThreadingHTTPServer((host, port), FakeTelegramHandler)
+        self.server.daemon_threads = True
+        self.server.fake = self
+        self.calls = []
+        self.condition = threading.Condition()
+        self._message_ids = itertools.count(1)
+
+    @property
+    def api_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+
+    def record(self, method_name, params):
+        with self.condition:
+            self.calls.append((time.perf_counter(), method_name, params))
+            self.condition.notify_all()
+        if method_name == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+        if method_name == 'getUpdates':
+            return []
+        if method_name.startswith('send') or method_name == 'editMessageText':
+            return {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+                'text': params.get('text', ''),
+            }
+        return True
+
+    # Ждет, пока не наберется count вызовов (всего с момента старта)
+    def wait_for(self, count, timeout=10):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            while len(self.calls) < count:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+            return True
+
+
+def message_update(update_id, user_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test', 'last_name': f'User{user_id}', 'username': f'user{user_id}'},
+            'text': text,
+        },
+    }
+
+
+def callback_update(update_id, user_id, data, message_id=1):
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'Test', 'last_name': f'User{user_id}'},
+            'message': {'message_id': message_id, 'date': int(time.time()), 'chat': {'id': user_id, 'type': 'private'}, 'text': ''},
+        },
+    }
+
+
+# Отправляет обновление на webhook так же, как это делает Telegram
+def post_update(url, update, secret=None):
+    request = urllib.request.Request(url, data=json.dumps(update).encode('utf-8'), method='POST')
+    request.add_header('Content-Type', 'application/json')
+    if secret:
+        request.add_header('X-Telegram-Bot-Api-Secret-Token', secret)
+    with urllib.request.urlopen(request) as response:
+        return response.status
+
+
+# Сценарий одного отзыва: (тип обновления, текст или callback data)
+REVIEW_SCRIPT = [
+    ('message', '/start'),
+    ('message', 'Write a review'),
+    ('callback', 'toggle_position_Designer'),
+    ('callback', 'positions_done'),
+    ('message', 'Designed the onboarding flow'),
+    ('message', '5'),
+    ('message', '4'),
+    ('message', '5'),
+    ('message', '4'),
+    ('message', '3'),
+    ('message', '5'),
+    ('message', '4'),
+    ('message', 'Learned to run user interviews'),
+    ('message', '5'),
+    ('message', 'Read reviews'),
+    ('message', 'View overall summary'),
+]
+
+
+def main():
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, repo_dir)
+    os.environ.setdefault('API_TOKEN', '0:fake')
+    # У фейкового API нет лимитов, сценарий шлет ответы без пауз
+    os.environ.setdefault('SEND_CHAT_RATE', '1000')
+    os.environ.setdefault('SEND_CHAT_BURST', '1000')
+    os.chdir(tempfile.mkdtemp(prefix='tiddle-fake-'))
+
+    fake = FakeTelegram().start()
+    from telebot import apihelper
+    apihelper.API_URL = fake.api_url
+
+    import bot
+    import webhook
+    secret = 'local-secret'
+    server = webhook.make_server(bot.bot, secret=secret, host='127.0.0.1', port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}{webhook.WEBHOOK_PATH}"
+
+    failures = 0
+    # Запрос с неверным секретом должен быть отклонен
+    try:
+        post_update(url, message_update(1, 1, '/start'), secret='wrong')
+        print("FAIL: update with a wrong secret was accepted")
+        failures += 1
+    except urllib.error.HTTPError as e:
+        print(f"Wrong secret rejected with HTTP {e.code}")
+
+    update_ids = itertools.count(2)
+    latencies = []
+    for kind, value in REVIEW_SCRIPT:
+        update_id = next(update_ids)
+        if kind == 'message':
+            update = message_update(update_id, 42, value)
+        else:
+            update = callback_update(update_id, 42, value)
+        expected = len(fake.calls) + 1
+        started = time.perf_counter()
+        post_update(url, update, secret=secret)
+        acked = time.perf_counter()
+        if not fake.wait_for(expected):
+            print(f"FAIL: no response to {value!r}")
+            failures += 1
+            continue
+        answered = fake.calls[expected - 1][0]
+        bot.bot.workers.join()
+        bot.sender.join()
+        latencies.append(answered - started)
+        print(f"{value[:30]:<32} ack {1000 * (acked - started):6.1f} ms, reply {1000 * (answered - started):6.1f} ms")
+
+    for _, method_name, params in fake.calls[-2:]:
+        print(method_name, params.get('text', '')[:200])
+    if latencies:
+        print(f"Average update-to-response latency: {1000 * sum(latencies) / len(latencies):.1f} ms")
+    server.shutdown()
+    fake.stop()
+    return failures
+
+
+if __name__ == '__main__':
+    # Ненулевой код выхода, если хоть одна проверка не прошла (для CI)
+    sys.exit(1 if main() else 0)
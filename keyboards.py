@@ -0,0 +1,84 @@
+# Готовые клавиатуры. Статические клавиатуры создаются и сериализуются один
+# раз при импорте, клавиатура выбора позиций кэшируется по битовой маске.
+from functools import lru_cache
+
+from telebot import types
+
+
+# Сериализуем клавиатуру один раз: telebot вызывает to_json() на каждой отправке.
+# Замороженную клавиатуру больше нельзя менять.
+def freeze(markup):
+    json_text = markup.to_json()
+    markup.to_json = lambda: json_text
+    return markup
+
+
+def build_main_keyboard():
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    markup.add(types.KeyboardButton('Write a review'), types.KeyboardButton('Read reviews'))
+    return markup
+
+
+def build_read_menu_keyboard():
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    markup.add(types.KeyboardButton('View reviews'), types.KeyboardButton('View overall summary'))
+    markup.add(types.KeyboardButton('By position'), types.KeyboardButton('Rating distributions'))
+    markup.add(types.KeyboardButton('Last 30 days'), types.KeyboardButton('Back to main menu'))
+    return markup
+
+
+# Клавиатура с цифрами от 1 до 5 в одном ряду
+def build_rating_keyboard():
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+    markup.row(*[types.KeyboardButton(str(i)) for i in range(1, 6)])
+    return markup
+
+
+# Выбор позиции для фильтра в просмотре отзывов
+def build_position_filter_keyboard(positions):
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("All positions", callback_data="reviews_page_0_all"))
+    for i, position in enumerate(positions):
+        markup.add(types.InlineKeyboardButton(position, callback_data=f"reviews_page_0_{i}"))
+    return markup
+
+
+MAIN_KEYBOARD = freeze(build_main_keyboard())
+READ_MENU_KEYBOARD = freeze(build_read_menu_keyboard())
+RATING_KEYBOARD = freeze(build_rating_keyboard())
+
+
+# Клавиатуры выбора позиций. Выбор хранится битовой маской (бит i - позиция i),
+# поэтому для каждого из 2^N состояний клавиатура строится не больше одного раза.
+class PositionKeyboards:
+    def __init__(self, positions):
+        self.positions = list(positions)
+        # Маска всех позиций; лишние биты отбрасываются, так что в кэше не больше 2^N клавиатур
+        self.full_mask = (1 << len(self.positions)) - 1
+        self._markup = lru_cache(maxsize=1 << len(self.positions))(self._build)
+
+    def markup(self, mask):
+        return self._markup(mask & self.full_mask)
+
+    def _build(self, mask):
+        markup = types.InlineKeyboardMarkup()
+        for i, position in enumerate(self.positions):
+            button_text = f"✅ {position}" if mask & (1 << i) else position
+            markup.add(types.InlineKeyboardButton(button_text, callback_data=f"toggle_position_{i}"))
+        # Add 'Done' button
+        markup.add(types.InlineKeyboardButton("Done", callback_data="positions_done"))
+        return freeze(markup)
+
+    # Маска -> список выбранных позиций в порядке списка
+    def selected(self, mask):
+        return [position for i, position in enumerate(self.positions) if mask & (1 << i)]
+
+    # Номер позиции из callback data: новый формат - номер, старый - название.
+    # None, если такой позиции нет (устаревшая или подделанная кнопка)
+    def index(self, key):
+        if key.isdigit():
+            index = int(key)
+            return index if index < len(self.positions) else None
+        if key in self.positions:
+            return self.positions.index(key)
+        return None
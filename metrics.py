@@ -0,0 +1,239 @@
+# Легковесные метрики в формате Prometheus: счетчики, гистограммы задержек
+# и датчики. Отдаются по HTTP на METRICS_PORT (/metrics); медленные операции
+# дополнительно пишутся в лог одной строкой key=value. Там же проверки для
+# оркестратора: /health (процесс жив) и /ready (данные загружены).
+import functools
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_HOST = os.getenv('METRICS_HOST', '0.0.0.0')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9100'))
+# Операции дольше этого порога (в секундах) пишутся в лог
+SLOW_OP_SECONDS = float(os.getenv('SLOW_OP_SECONDS', '0.5'))
+
+# Границы корзин гистограмм задержек, секунды
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+logger = logging.getLogger(__name__)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in pairs) + '}'
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in self.values.items():
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        # Ключ меток -> [счетчики по корзинам..., сумма, количество]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            series[-2] += value
+            series[-1] += 1
+
+    # Замер времени блока; медленные операции пишутся в лог
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe(elapsed, **labels)
+            if elapsed >= SLOW_OP_SECONDS:
+                details = ' '.join(f"{name}={value}" for name, value in _label_key(labels))
+                logger.warning("slow_operation metric=%s %s duration_ms=%.1f", self.name, details, elapsed * 1000)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, series in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, series):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {cumulative}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {series[-1]}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-2]}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series[-1]}")
+        return lines
+
+
+# Датчик: значение считается в момент запроса /metrics
+class Gauge:
+    def __init__(self, name, help_text, func):
+        self.name = name
+        self.help_text = help_text
+        self.func = func
+
+    def render(self):
+        try:
+            value = self.func()
+        except Exception as e:
+            logger.error("Gauge %s failed: %s", self.name, e)
+            return []
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+METRICS = []
+
+
+def counter(name, help_text):
+    metric = Counter(name, help_text)
+    METRICS.append(metric)
+    return metric
+
+
+def histogram(name, help_text, buckets=LATENCY_BUCKETS):
+    metric = Histogram(name, help_text, buckets)
+    METRICS.append(metric)
+    return metric
+
+
+def gauge(name, help_text, func):
+    metric = Gauge(name, help_text, func)
+    METRICS.append(metric)
+    return metric
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+HANDLER_SECONDS = histogram('tiddle_handler_seconds', 'Time spent in bot update handlers.')
+HANDLER_ERRORS = counter('tiddle_handler_errors_total', 'Exceptions raised by bot update handlers.')
+STORAGE_SECONDS = histogram('tiddle_storage_seconds', 'Time spent in storage operations.')
+TELEGRAM_SECONDS = histogram('tiddle_telegram_api_seconds', 'Round-trip time of Telegram Bot API requests.')
+TELEGRAM_ERRORS = counter('tiddle_telegram_api_errors_total', 'Failed Telegram Bot API requests by error code.')
+STARTUP_SECONDS = histogram('tiddle_startup_phase_seconds', 'Duration of startup phases.')
+
+# Выставляется, когда бот прогрел данные и готов отвечать без задержек
+READY = threading.Event()
+gauge('tiddle_ready', 'Whether the bot has finished warming up.', lambda: int(READY.is_set()))
+
+
+# Длительность фазы запуска: в метрику и в лог
+def record_startup_phase(name, seconds):
+    STARTUP_SECONDS.observe(seconds, phase=name)
+    logger.info("startup_phase phase=%s duration_ms=%.1f", name, seconds * 1000)
+
+
+@contextmanager
+def startup_phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_startup_phase(name, time.perf_counter() - started)
+
+
+def _timed_handler(function, histogram_metric, labels):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with histogram_metric.time(**labels):
+            try:
+                return function(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(**labels)
+                raise
+    return wrapper
+
+
+# Оборачивает все зарегистрированные обработчики telebot замером времени
+def instrument_handlers(bot):
+    for handlers in (bot.message_handlers, bot.callback_query_handlers):
+        for handler in handlers:
+            function = handler['function']
+            handler['function'] = _timed_handler(function, HANDLER_SECONDS, {'handler': function.__name__})
+
+
+# Оборачивает методы объекта замером времени с меткой operation
+def instrument_methods(obj, names, histogram_metric=STORAGE_SECONDS):
+    for name in names:
+        method = getattr(obj, name)
+
+        def wrapper(*args, _method=method, _name=name, **kwargs):
+            with histogram_metric.time(operation=_name):
+                return _method(*args, **kwargs)
+
+        functools.update_wrapper(wrapper, method)
+        setattr(obj, name, wrapper)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._reply(200, render(), 'text/plain; version=0.0.4; charset=utf-8')
+        elif self.path == '/health':
+            self._reply(200, 'ok\n')
+        elif self.path == '/ready':
+            if READY.is_set():
+                self._reply(200, 'ready\n')
+            else:
+                self._reply(503, 'warming up\n')
+        else:
+            self.send_error(404)
+
+    def _reply(self, status, text, content_type='text/plain; charset=utf-8'):
+        payload = text.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+# Запускает HTTP-сервер метрик в фоновом потоке
+def start_server(host=METRICS_HOST, port=METRICS_PORT, handler_class=MetricsHandler):
+    server = ThreadingHTTPServer((host, port), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='MetricsServer', daemon=True).start()
+    return server
@@ -0,0 +1,251 @@
+# Очередь исходящих запросов к Telegram с учетом лимитов.
+# Обработчики только ставят запрос в очередь, а потоки отправки выбирают
+# чаты по кругу, соблюдая общий лимит (~30 сообщений/с) и лимит на чат
+# (~1 новое сообщение/с с небольшим запасом на всплеск). На ответ 429 запрос
+# откладывается на retry_after секунд и повторяется, а несколько подряд
+# изменений одной и той же клавиатуры схлопываются в последнее.
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+import requests
+from telebot.apihelper import ApiTelegramException
+
+import metrics
+
+GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', '30'))
+CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', '1'))
+CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', '3'))
+MAX_QUEUE = int(os.getenv('SEND_MAX_QUEUE', '10000'))
+SENDER_THREADS = int(os.getenv('SENDER_THREADS', '4'))
+# Методы, которые расходуют лимит чата (изменения и ответы на кнопки - только общий)
+CHAT_LIMITED_METHODS = {'send_message', 'send_document'}
+# Сколько раз повторяем запрос при сетевой ошибке
+MAX_RETRIES = 5
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Через сколько секунд будет доступен токен (0 - уже доступен)
+    def wait_time(self, now):
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def idle(self, now):
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.blocked_until
+
+
+class Job:
+    __slots__ = ('method', 'args', 'kwargs', 'coalesce_key', 'attempts', 'on_done')
+
+    def __init__(self, method, args, kwargs, coalesce_key=None, on_done=None):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.coalesce_key = coalesce_key
+        self.attempts = 0
+        # Вызывается после последней попытки (успешной или нет)
+        self.on_done = on_done
+
+
+class OutboundSender:
+    def __init__(self, bot, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE, chat_burst=CHAT_BURST,
+                 max_queue=MAX_QUEUE, num_threads=SENDER_THREADS):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_queue = max_queue
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.condition = threading.Condition()
+        # Ключ очереди -> deque заданий; порядок ключей задает обход по кругу
+        self.queues = OrderedDict()
+        self.chat_buckets = {}
+        # Ключ без лимита чата (ответы на кнопки) -> до какого момента не отправлять
+        # после сетевой ошибки; общий лимит блокирует только настоящий 429
+        self.blocked_keys = {}
+        self.in_flight = set()
+        self.queued = 0
+        self.last_prune = time.monotonic()
+        for i in range(num_threads):
+            threading.Thread(target=self._run, name=f"Sender-{i}", daemon=True).start()
+
+    # Методы с сигнатурами как у TeleBot
+
+    def send_message(self, chat_id, text, **kwargs):
+        self._put(chat_id, Job('send_message', (chat_id, text), kwargs))
+
+    # Файл перед каждой попыткой перематывается в начало; on_done, например,
+    # закрывает временный файл, когда отправка завершена
+    def send_document(self, chat_id, document, on_done=None, **kwargs):
+        self._put(chat_id, Job('send_document', (chat_id, document), kwargs, on_done=on_done))
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        kwargs.update(chat_id=chat_id, message_id=message_id)
+        self._put(chat_id, Job('edit_message_text', (text,), kwargs, ('text', message_id)))
+
+    def edit_message_reply_markup(self, chat_id, message_id, reply_markup=None):
+        kwargs = {'chat_id': chat_id, 'message_id': message_id, 'reply_markup': reply_markup}
+        self._put(chat_id, Job('edit_message_reply_markup', (), kwargs, ('markup', message_id)))
+
+    # Ответ на нажатие кнопки не привязан к лимиту чата, только к общему
+    def answer_callback_query(self, callback_query_id, text=None, **kwargs):
+        self._put(('callback', callback_query_id), Job('answer_callback_query', (callback_query_id, text), kwargs))
+
+    def _put(self, key, job):
+        with self.condition:
+            queue = self.queues.get(key)
+            if job.coalesce_key is not None and queue:
+                # Еще не отправленное изменение того же сообщения заменяем новым
+                for pending in queue:
+                    if pending.coalesce_key == job.coalesce_key:
+                        pending.args, pending.kwargs = job.args, job.kwargs
+                        return
+            # Очередь ограничена: при переполнении обработчик ждет отправки
+            while self.queued >= self.max_queue:
+                self.condition.wait()
+            self.queues.setdefault(key, deque()).append(job)
+            self.queued += 1
+            self.condition.notify_all()
+
+    def _bucket(self, key):
+        if isinstance(key, tuple):
+            return None  # Не чат: без лимита на чат
+        bucket = self.chat_buckets.get(key)
+        if bucket is None:
+            bucket = self.chat_buckets[key] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    # Выбор следующего задания: (ключ, задание) или время ожидания
+    def _next_job(self, now):
+        global_wait = self.global_bucket.wait_time(now)
+        if global_wait:
+            return None, global_wait
+        wait = None
+        for key, queue in self.queues.items():
+            if key in self.in_flight:
+                continue  # Сохраняем порядок внутри чата
+            bucket = self._bucket(key)
+            limited = bucket is not None and queue[0].method in CHAT_LIMITED_METHODS
+            if limited:
+                chat_wait = bucket.wait_time(now)
+            elif bucket is not None:
+                chat_wait = max(0, bucket.blocked_until - now)
+            else:
+                chat_wait = max(0, self.blocked_keys.get(key, 0) - now)
+            if chat_wait:
+                wait = chat_wait if wait is None else min(wait, chat_wait)
+                continue
+            job = queue.popleft()
+            if not queue:
+                del self.queues[key]
+            else:
+                self.queues.move_to_end(key)
+            if limited:
+                bucket.take(now)
+            self.global_bucket.take(now)
+            self.in_flight.add(key)
+            return (key, job), None
+        return None, wait
+
+    def _prune(self, now):
+        for key in [key for key, bucket in self.chat_buckets.items() if key not in self.queues and bucket.idle(now)]:
+            del self.chat_buckets[key]
+        self.last_prune = now
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while True:
+                    now = time.monotonic()
+                    if now - self.last_prune > 60:
+                        self._prune(now)
+                    selected, wait = self._next_job(now)
+                    if selected:
+                        break
+                    self.condition.wait(wait)
+            key, job = selected
+            retry = self._execute(job)
+            if retry is None and job.on_done is not None:
+                try:
+                    job.on_done()
+                except Exception as e:
+                    logger.exception("Error in on_done of %s: %s", job.method, e)
+            with self.condition:
+                self.in_flight.discard(key)
+                self.blocked_keys.pop(key, None)
+                if retry is None:
+                    self.queued -= 1
+                else:
+                    # Возвращаем задание в начало очереди своего ключа и ждем
+                    retry_after, rate_limited = retry
+                    self.queues.setdefault(key, deque()).appendleft(job)
+                    until = time.monotonic() + retry_after
+                    bucket = self._bucket(key)
+                    if bucket is not None:
+                        bucket.blocked_until = until
+                    elif rate_limited:
+                        self.global_bucket.blocked_until = until
+                    else:
+                        self.blocked_keys[key] = until
+                self.condition.notify_all()
+
+    # Выполняет запрос; возвращает None или (через сколько секунд повторить,
+    # был ли это ответ 429)
+    def _execute(self, job):
+        job.attempts += 1
+        try:
+            for arg in job.args:
+                if hasattr(arg, 'seek'):
+                    arg.seek(0)  # Повтор отправки файла начинается с начала
+            with metrics.TELEGRAM_SECONDS.time(method=job.method):
+                getattr(self.bot, job.method)(*job.args, **job.kwargs)
+        except ApiTelegramException as e:
+            metrics.TELEGRAM_ERRORS.inc(method=job.method, code=e.error_code)
+            if e.error_code == 429:
+                parameters = (e.result_json or {}).get('parameters', {})
+                return parameters.get('retry_after', 1), True
+            if 'message is not modified' not in e.description:
+                logger.error("Telegram API error in %s: %s", job.method, e)
+        except requests.exceptions.RequestException as e:
+            metrics.TELEGRAM_ERRORS.inc(method=job.method, code='network')
+            if job.attempts < MAX_RETRIES:
+                return 2 ** job.attempts / 2, False
+            logger.error("Giving up on %s after %d attempts: %s", job.method, job.attempts, e)
+        except Exception as e:
+            logger.exception("Error in %s: %s", job.method, e)
+        return None
+
+    # Ждет, пока очередь не опустеет, но не дольше timeout секунд.
+    # Возвращает False, если время вышло.
+    def join(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            while self.queued:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
@@ -0,0 +1,133 @@
+# Описание анкеты отзыва. Шаги перечислены по порядку; при старте они
+# компилируются в таблицу состояние -> шаг, так что обработка ответа - это
+# один поиск в словаре, а клавиатуры берутся готовые.
+from keyboards import RATING_KEYBOARD
+
+# Define the list of positions
+POSITIONS = [
+    'Product Manager',
+    'Tracker/Project Manager',
+    'Content Creator',
+    'Marketer',
+    'Frontend Developer',
+    'Backend Developer',
+    'DevOps Engineer',
+    'Psychologist',
+    'Designer',
+    'Data Scientist',
+    'Fundraising Manager'
+]
+
+# Criteria for the multiple ratings question
+RATING_CRITERIA = [
+    'Working atmosphere in the team',
+    'Convenience of schedule',
+    'Activity of founders',
+    'Activity of the whole team',
+    'Opportunities for self-realization and creativity'
+]
+
+RATING_ERROR = "Please enter a valid rating between 1 and 5."
+
+
+# Function to validate rating input
+def validate_rating(text):
+    try:
+        rating = int(text)
+        return 1 <= rating <= 5
+    except ValueError:
+        return False
+
+
+# Один вопрос анкеты.
+# kind: 'positions' (выбор кнопками), 'text' (свободный ответ) или 'rating' (1-5).
+# Ответ пишется в review[field], а если задан criterion - в
+# review['multiple_ratings'][criterion].
+class Step:
+    def __init__(self, state, prompt, kind, field=None, criterion=None):
+        self.state = state
+        self.prompt = prompt
+        self.kind = kind
+        self.field = field
+        self.criterion = criterion
+        self.keyboard = None
+        self.next = None
+
+    # Разбор ответа: (значение, None) или (None, текст ошибки)
+    def parse(self, text):
+        if self.kind == 'rating':
+            if validate_rating(text):
+                return int(text), None
+            return None, RATING_ERROR
+        return text, None
+
+    def store(self, review, value):
+        if self.criterion is not None:
+            review.setdefault('multiple_ratings', {})[self.criterion] = value
+        else:
+            review[self.field] = value
+
+
+STEPS = [
+    Step(
+        'awaiting_position_selection',
+        "1. Please select the position(s) you interned for. You can select multiple positions.",
+        'positions'
+    ),
+    Step(
+        'awaiting_experience_description',
+        "2. Describe the experience you gained in terms of tasks and skill development.",
+        'text',
+        field='experience_description'
+    ),
+    Step(
+        'awaiting_satisfaction_rating',
+        "3. How satisfied are you with the experience gained? Rate on a scale of 1-5 (where 1 - not satisfied at all, there was nothing useful, 5 - the experience I received completely met or exceeded my expectations).",
+        'rating',
+        field='satisfaction_rating'
+    ),
+    Step(
+        'awaiting_interaction_process_rating',
+        "4. How well are the interaction processes built in the team? Rate on a scale of 1-5 (where 1 is very bad, nothing clear, 5 is very good and clear).",
+        'rating',
+        field='interaction_process_rating'
+    ),
+] + [
+    Step(
+        f'awaiting_multiple_rating_{i}',
+        (f"5. Rate the following on a scale of 1-5 (where 1 is all very bad, 5 is very good).\n\n{criterion}:" if i == 0 else f"{criterion}:"),
+        'rating',
+        criterion=criterion
+    )
+    for i, criterion in enumerate(RATING_CRITERIA)
+] + [
+    Step(
+        'awaiting_professional_development_effect',
+        "6. What effect did the internship have on your professional development?",
+        'text',
+        field='professional_development_effect'
+    ),
+    Step(
+        'awaiting_overall_satisfaction_rating',
+        "7. Overall satisfaction with the internship on a scale of 1-5 (where 1- not satisfied at all, 5 - fully satisfied).",
+        'rating',
+        field='overall_satisfaction'
+    ),
+]
+
+
+# Связывает шаги по порядку, назначает клавиатуры и возвращает таблицу состояний
+def compile_questionnaire(steps):
+    table = {}
+    for step, next_step in zip(steps, steps[1:] + [None]):
+        if step.state in table:
+            raise ValueError(f"Duplicate questionnaire state: {step.state}")
+        step.next = next_step
+        if step.kind == 'rating':
+            step.keyboard = RATING_KEYBOARD
+        table[step.state] = step
+    return table
+
+
+QUESTIONNAIRE = compile_questionnaire(STEPS)
+FIRST_STEP = STEPS[0]
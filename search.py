@@ -0,0 +1,227 @@
+# Полнотекстовый поиск по свободным ответам отзывов (описание опыта и
+# влияние на профессиональное развитие). Обратный индекс термин -> {id
+# отзыва: частота} обновляется по одному отзыву и хранится рядом с данными
+# так же, как отзывы: снимок + журнал добавлений (JSONL). Результаты
+# ранжируются по BM25.
+import heapq
+import json
+import logging
+import math
+import os
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import Counter
+
+from storage import atomic_write, replay_log
+
+# Сколько записей журнала накапливаем перед сжатием в снимок
+SEARCH_COMPACT_EVERY = int(os.getenv('SEARCH_COMPACT_EVERY', '5000'))
+# Поля отзыва, которые попадают в индекс
+TEXT_FIELDS = ['experience_description', 'professional_development_effect']
+# Термины запроса не короче этого ищутся и как префикс ("опыт" найдет "опыта")
+PREFIX_MIN_LENGTH = 4
+# Вес совпадения по префиксу относительно точного
+PREFIX_WEIGHT = 0.5
+# Больше этого результатов не возвращаем
+MAX_RESULTS = 200
+# Параметры BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TOKEN_RE = re.compile(r"\w+")
+# Латинские и кириллические буквы, которые выглядят одинаково
+LATIN_LOOKALIKES = 'aeopcyxkm'
+CYRILLIC_LOOKALIKES = 'аеорсухкм'
+TO_CYRILLIC = str.maketrans(LATIN_LOOKALIKES, CYRILLIC_LOOKALIKES)
+TO_LATIN = str.maketrans(CYRILLIC_LOOKALIKES, LATIN_LOOKALIKES)
+
+logger = logging.getLogger(__name__)
+
+
+# В словах, набранных вперемешку кириллицей и латиницей ("oпыт" с латинской o),
+# похожие буквы заменяются на буквы преобладающего алфавита
+def fold_homoglyphs(token):
+    cyrillic = sum('а' <= ch <= 'я' for ch in token)
+    latin = sum('a' <= ch <= 'z' for ch in token)
+    if cyrillic and latin:
+        return token.translate(TO_CYRILLIC if cyrillic >= latin else TO_LATIN)
+    return token
+
+
+# Текст -> список терминов: NFKC, без учета регистра, ё = е
+def tokenize(text):
+    text = unicodedata.normalize('NFKC', text).casefold().replace('ё', 'е')
+    return [fold_homoglyphs(token) for token in TOKEN_RE.findall(text) if len(token) > 1]
+
+
+def review_terms(review):
+    return Counter(token for field in TEXT_FIELDS for token in tokenize(review.get(field) or ''))
+
+
+class SearchIndex:
+    def __init__(self, index_file, compact_every=SEARCH_COMPACT_EVERY):
+        self.index_file = index_file
+        self.log_file = os.path.splitext(index_file)[0] + '.log'
+        self.compact_every = compact_every
+        self.lock = threading.RLock()
+        self.loaded = False
+        self._log_records = 0
+        self._clear()
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            self._clear()
+            try:
+                with open(self.index_file, 'r') as f:
+                    snapshot = json.load(f)
+                for review_id, length in snapshot['lengths'].items():
+                    self._lengths[int(review_id)] = length
+                    self._total_length += length
+                self._last_id = max(self._lengths, default=0)
+                for term, postings in snapshot['postings'].items():
+                    self._postings[term] = {int(review_id): tf for review_id, tf in postings.items()}
+            except FileNotFoundError:
+                pass
+            except (json.JSONDecodeError, KeyError, ValueError, AttributeError) as e:
+                # Индекс можно построить заново по отзывам
+                logger.error("Search index %s is damaged (%s), rebuilding.", self.index_file, e)
+                self._clear()
+            self._log_records = self._replay_log()
+            self.loaded = True
+
+    def _clear(self):
+        self._postings = {}
+        self._lengths = {}
+        self._total_length = 0
+        self._sorted_terms = None
+        self._last_id = 0
+        # Сверен ли индекс с хранилищем после загрузки
+        self._verified = False
+
+    # Оборванную последнюю запись доиндексирует sync()
+    def _replay_log(self):
+        return replay_log(self.log_file, lambda record: self._apply(record['id'], record['terms']))
+
+    def _apply(self, review_id, terms):
+        if review_id in self._lengths:
+            return False
+        for term, tf in terms.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                self._sorted_terms = None
+            postings[review_id] = tf
+        length = sum(terms.values())
+        self._lengths[review_id] = length
+        self._total_length += length
+        self._last_id = max(self._last_id, review_id)
+        return True
+
+    # Добавляет отзыв в индекс и в журнал
+    def add(self, review):
+        with self.lock:
+            self.load()
+            self._add_all([review])
+
+    # Добавляет отзывы, которых еще нет в индексе, одной дозаписью журнала.
+    # Возвращает число добавленных.
+    def _add_all(self, reviews):
+        added = 0
+        with open(self.log_file, 'a') as f:
+            for review in reviews:
+                terms = review_terms(review)
+                if self._apply(review['id'], terms):
+                    f.write(json.dumps({'id': review['id'], 'terms': terms}, ensure_ascii=False) + '\n')
+                    added += 1
+        self._log_records += added
+        if self._log_records >= self.compact_every:
+            self.compact()
+        return added
+
+    # Доиндексирует отзывы, которых нет в индексе (записанные до его
+    # появления, другим процессом или потерянные при падении), через журнал.
+    # Обычно это только отзывы новее последнего проиндексированного; полная
+    # сверка с хранилищем - после загрузки и когда число отзывов не сошлось.
+    # Если в индексе есть отзывы, которых больше нет в хранилище, или индекс
+    # пуст, он строится заново сразу в снимок.
+    def sync(self, store):
+        with self.lock:
+            self.load()
+            last_id = store.last_review_id()
+            if last_id == self._last_id and self._verified:
+                return self
+            if not self._lengths:
+                self._rebuild(store)
+                return self
+            added = 0
+            if last_id > self._last_id:
+                added = self._add_all(review for _, _, _, review in store.iter_reviews(after_id=self._last_id))
+            if last_id != self._last_id or len(self) != store.review_count():
+                refs = store.review_refs()
+                if len(self) > len(refs) or not self._lengths.keys() <= set(refs):
+                    self._rebuild(store)
+                    return self
+                missing = (review_id for review_id in refs if review_id not in self._lengths)
+                added += self._add_all(
+                    user_info['reviews'][index] for user_info, index in map(store.get_review, missing)
+                )
+            if added:
+                logger.info("Indexed %d reviews for search.", added)
+            self._verified = True
+            return self
+
+    def _rebuild(self, store):
+        self._clear()
+        for _, _, _, review in store.iter_reviews():
+            self._apply(review['id'], review_terms(review))
+        self.compact()
+        self._verified = True
+        logger.info("Indexed %d reviews for search.", len(self))
+
+    def compact(self):
+        with self.lock:
+            snapshot = {'lengths': self._lengths, 'postings': self._postings}
+            atomic_write(self.index_file, lambda f: json.dump(snapshot, f, ensure_ascii=False))
+            open(self.log_file, 'w').close()
+            self._log_records = 0
+
+    # Термины индекса, начинающиеся с prefix
+    def _prefixed(self, prefix):
+        if self._sorted_terms is None:
+            self._sorted_terms = sorted(self._postings)
+        terms = self._sorted_terms
+        i = bisect_left(terms, prefix)
+        while i < len(terms) and terms[i].startswith(prefix):
+            yield terms[i]
+            i += 1
+
+    # id отзывов по убыванию релевантности
+    def search(self, query, limit=MAX_RESULTS):
+        with self.lock:
+            self.load()
+            if not self._lengths:
+                return []
+            count = len(self._lengths)
+            average_length = self._total_length / count or 1
+            scores = {}
+            for query_term in set(tokenize(query)):
+                matches = {query_term: 1.0}
+                if len(query_term) >= PREFIX_MIN_LENGTH:
+                    for term in self._prefixed(query_term):
+                        matches.setdefault(term, PREFIX_WEIGHT)
+                for term, weight in matches.items():
+                    postings = self._postings.get(term)
+                    if not postings:
+                        continue
+                    idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for review_id, tf in postings.items():
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths[review_id] / average_length)
+                        scores[review_id] = scores.get(review_id, 0) + weight * idf * tf * (BM25_K1 + 1) / (tf + norm)
+            return [review_id for review_id, _ in heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], -item[0]))]
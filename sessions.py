@@ -0,0 +1,128 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import storage
+
+# Сколько секунд живет незаконченный отзыв без активности
+SESSION_TTL = int(os.getenv('SESSION_TTL', str(24 * 60 * 60)))
+# Сколько сессий держим в памяти одновременно
+MAX_SESSIONS = int(os.getenv('MAX_SESSIONS', '10000'))
+# Как часто (в операциях записи) вычищаем просроченные сессии
+PURGE_EVERY = 1000
+
+
+# Состояние диалога одного пользователя: шаг анкеты и собранные ответы
+class Session:
+    __slots__ = ('user_id', 'state', 'data', 'touched')
+
+    def __init__(self, user_id, state=None, data=None, touched=None):
+        self.user_id = user_id
+        self.state = state
+        self.data = data if data is not None else {}
+        self.touched = touched if touched is not None else time.time()
+
+
+# Хранилище сессий: LRU в памяти с ограничением MAX_SESSIONS и сроком жизни
+# SESSION_TTL. Если задан db_file, сессии дублируются в SQLite и переживают
+# перезапуск контейнера; вытесненные из памяти сессии подгружаются оттуда.
+# В режиме shared (несколько экземпляров на одной базе) сессии в памяти не
+# держатся: каждое чтение идет в базу, чтобы видеть изменения других экземпляров.
+class SessionStore:
+    def __init__(self, db_file=None, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS, shared=False):
+        if shared and not db_file:
+            raise ValueError("Shared sessions need a database file")
+        self.db_file = db_file
+        self.shared = shared
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.lock = threading.RLock()
+        self._sessions = OrderedDict()
+        self._local = threading.local()
+        self._writes = 0
+
+    def _connection(self):
+        return storage.thread_connection(self._local, self.db_file, self._setup_connection)
+
+    def _setup_connection(self, conn):
+        with conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "user_id INTEGER PRIMARY KEY, state TEXT, data TEXT NOT NULL, touched REAL NOT NULL)"
+            )
+
+    def _expired(self, touched, now):
+        return now - touched > self.ttl
+
+    # Сессия пользователя. Если ее нет или она просрочена, возвращается
+    # новая пустая сессия, которая сохранится только после save().
+    def get(self, user_id):
+        now = time.time()
+        with self.lock:
+            session = self._sessions.get(user_id)
+            if session is not None:
+                if not self._expired(session.touched, now):
+                    self._sessions.move_to_end(user_id)
+                    return session
+                self.reset(user_id)
+            elif self.db_file:
+                row = self._connection().execute(
+                    "SELECT state, data, touched FROM sessions WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                if row is not None and not self._expired(row[2], now):
+                    session = Session(user_id, row[0], json.loads(row[1]), row[2])
+                    self._remember(session)
+                    return session
+        return Session(user_id)
+
+    def _remember(self, session):
+        if self.shared:
+            return
+        self._sessions[session.user_id] = session
+        self._sessions.move_to_end(session.user_id)
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
+
+    # Запоминает изменения сессии (после смены шага или ответа)
+    def save(self, session):
+        session.touched = time.time()
+        with self.lock:
+            self._remember(session)
+            if self.db_file:
+                conn = self._connection()
+                with conn:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO sessions (user_id, state, data, touched) VALUES (?, ?, ?, ?)",
+                        (session.user_id, session.state, json.dumps(session.data, separators=(',', ':')), session.touched)
+                    )
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                self.purge()
+
+    # Удаляет сессию пользователя (отзыв сохранен или пользователь вышел в меню)
+    def reset(self, user_id):
+        with self.lock:
+            self._sessions.pop(user_id, None)
+            if self.db_file:
+                conn = self._connection()
+                with conn:
+                    conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    # Вычищает просроченные сессии из памяти и базы
+    def purge(self):
+        now = time.time()
+        with self.lock:
+            for user_id in [user_id for user_id, session in self._sessions.items() if self._expired(session.touched, now)]:
+                del self._sessions[user_id]
+            if self.db_file:
+                conn = self._connection()
+                with conn:
+                    conn.execute("DELETE FROM sessions WHERE touched < ?", (now - self.ttl,))
+
+    def __len__(self):
+        with self.lock:
+            if self.shared:
+                return self._connection().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+            return len(self._sessions)
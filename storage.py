@@ -0,0 +1,869 @@
+import argparse
+import json
+import logging
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # Windows: блокировка файла данных не поддерживается
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from aggregates import RATING_FIELDS, ReviewAggregates, add_rating_count, empty_counter
+
+# Сколько записей журнала накапливаем перед сжатием в снимок
+COMPACT_EVERY = int(os.getenv('COMPACT_EVERY', '500'))
+
+logger = logging.getLogger(__name__)
+
+
+# Синхронизация каталога, чтобы rename пережил падение питания
+def fsync_dir(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return  # Например, на Windows каталоги так не открываются
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+# Соединение SQLite для текущего потока (хранится в local, threading.local):
+# создает каталог базы, включает WAL и один раз вызывает setup(conn) для
+# схемы. Общее для хранилища, сессий и аренды (cluster.py).
+def thread_connection(local, db_file, setup=None, **connect_kwargs):
+    conn = getattr(local, 'conn', None)
+    if conn is None:
+        directory = os.path.dirname(db_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(db_file, timeout=30, **connect_kwargs)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        if setup is not None:
+            setup(conn)
+        local.conn = conn
+    return conn
+
+
+# Чтение журнала JSONL (по записи на строку): каждая запись передается в
+# apply(record). На оборванной при падении или испорченной записи чтение
+# останавливается; с truncate=True хвост обрезается, чтобы новые записи не
+# склеились с мусором (обрезать может только процесс, который пишет журнал).
+# Возвращает число прочитанных записей.
+def replay_log(log_file, apply, truncate=True):
+    try:
+        f = open(log_file, 'rb')
+    except FileNotFoundError:
+        return 0
+    applied = 0
+    good_offset = 0
+    damaged = False
+    with f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                damaged = True  # Оборванная при падении последняя запись
+                break
+            if line.strip():
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    damaged = True
+                    break
+                apply(record)
+                applied += 1
+            good_offset += len(line)
+    if damaged and not truncate:
+        logger.warning("Damaged record in %s at byte %d, ignoring it.", log_file, good_offset)
+    elif damaged:
+        logger.warning("Damaged record in %s at byte %d, truncating.", log_file, good_offset)
+        with open(log_file, 'r+b') as f:
+            f.truncate(good_offset)
+            f.flush()
+            os.fsync(f.fileno())
+    return applied
+
+
+# Атомарная запись: пишем во временный файл, fsync, затем rename поверх старого
+def atomic_write(path, write):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        write(f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    fsync_dir(os.path.dirname(os.path.abspath(path)))
+
+
+# Попадает ли отзыв в диапазон дат; отзывы без даты (старые) в диапазон не попадают
+def in_date_range(review, since=None, until=None):
+    if since is None and until is None:
+        return True
+    created_at = review.get('created_at')
+    if created_at is None:
+        return False
+    return (since is None or created_at >= since) and (until is None or created_at < until)
+
+
+# Интерфейс хранилища отзывов. Данные пользователя имеют вид
+# {'name', 'nickname', 'reviews': [...]}, у каждого отзыва есть целый 'id'.
+class Storage:
+    # Подготовка файлов/схемы
+    def init(self):
+        raise NotImplementedError
+
+    # Все данные {user_id: данные пользователя}
+    def load(self):
+        raise NotImplementedError
+
+    # Полная замена всех данных
+    def save(self, data):
+        raise NotImplementedError
+
+    # Добавляет отзыв и возвращает выданный ему id
+    def append_review(self, user_id, name, nickname, review):
+        raise NotImplementedError
+
+    # Данные одного пользователя или None
+    def get_user(self, user_id):
+        raise NotImplementedError
+
+    # Отзыв по id: (данные пользователя, номер отзыва) или None
+    def get_review(self, review_id):
+        raise NotImplementedError
+
+    # Все user id с таким отображаемым именем
+    def find_users(self, name):
+        raise NotImplementedError
+
+    # Упорядоченный список id отзывов, всех или по одной позиции
+    def review_refs(self, position=None):
+        raise NotImplementedError
+
+    # Отзывы по порядку id: (user_id, имя, ник, отзыв), по одному, без копии всех данных.
+    # Фильтр по позиции и по created_at: since <= created_at < until (строки ISO).
+    # after_id - только отзывы с большим id (догрузка новых записей).
+    def iter_reviews(self, position=None, since=None, until=None, after_id=0):
+        raise NotImplementedError
+
+    # Наибольший id отзыва (0, если отзывов нет). id только растут, поэтому
+    # это дешевый признак того, что появились новые отзывы.
+    def last_review_id(self):
+        raise NotImplementedError
+
+    def review_count(self):
+        raise NotImplementedError
+
+    # Накопленные счетчики ReviewAggregates
+    def aggregates(self):
+        raise NotImplementedError
+
+    # Пересчет счетчиков с нуля по отзывам, для проверки
+    def rebuild_aggregates(self):
+        return ReviewAggregates.rebuild(self.load())
+
+    def verify_aggregates(self):
+        return self.rebuild_aggregates() == self.aggregates()
+
+    # Обслуживание (сжатие журнала и т.п.)
+    def compact(self):
+        pass
+
+    # Размер файлов хранилища на диске, байты
+    def size_bytes(self):
+        raise NotImplementedError
+
+
+# Хранилище отзывов: снимок messages.json + журнал добавлений (JSONL).
+# Каждый новый отзыв дописывается в журнал одной строкой, а в памяти
+# держится индекс по user id. Раз в COMPACT_EVERY записей журнал
+# сворачивается в новый снимок.
+class JsonStorage(Storage):
+    def __init__(self, data_file, compact_every=COMPACT_EVERY):
+        self.data_file = data_file
+        self.log_file = os.path.splitext(data_file)[0] + '.log'
+        self.aggregates_file = os.path.splitext(data_file)[0] + '.aggregates.json'
+        self.lock_file = os.path.splitext(data_file)[0] + '.lock'
+        self._lock_fd = None
+        self.compact_every = compact_every
+        self.lock = threading.RLock()
+        self._data = None
+        self._aggregates = None
+        self._review_refs = {}
+        self._review_ids = {}
+        self._user_names = {}
+        self._next_id = 1
+        self._log_records = 0
+
+    # Писать в файлы может только один процесс: второй экземпляр бота на тех же
+    # файлах получит ошибку сразу, а не испортит снимок и журнал.
+    # required=False - только попытка (для читателей): False, если файлы
+    # заняты другим процессом.
+    def _lock_for_writing(self, required=True):
+        if self._lock_fd is not None or fcntl is None:
+            return True
+        fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            if not required:
+                return False
+            raise RuntimeError(
+                f"{self.data_file} is used by another process; "
+                "use STORAGE_BACKEND=sqlite to run several instances"
+            )
+        self._lock_fd = fd
+        return True
+
+    def _unlock(self):
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)  # Закрытие файла снимает flock
+            self._lock_fd = None
+
+    def init(self):
+        directory = os.path.dirname(self.data_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock_for_writing()
+        if not os.path.exists(self.data_file):
+            atomic_write(self.data_file, lambda f: json.dump({}, f))
+            logger.info("Data file created.")
+
+    # Возвращает индекс {user_id: {'name', 'nickname', 'reviews'}}.
+    # Это живой объект хранилища, изменять его нужно только через append_review/save.
+    # Файлы чинятся (обрезка журнала, сохранение выданных id) только если их
+    # не держит другой процесс; иначе это сделает он сам. Блокировку, взятую
+    # только ради починки, отпускаем, чтобы читатель (export.py) не мешал
+    # запуску бота.
+    def load(self):
+        with self.lock:
+            if self._data is None:
+                was_locked = self._lock_fd is not None
+                # Без каталога данных (init() не вызывали) и чинить нечего
+                writable = (os.path.isdir(os.path.dirname(self.data_file) or '.')
+                            and self._lock_for_writing(required=False))
+                self._data = self._read_snapshot(writable)
+                self._aggregates = self._read_aggregates()
+                assigned = self._build_indexes()
+                self._log_records = self._replay_log(writable)
+                if assigned and writable:
+                    # Старые отзывы получили id, сразу сохраняем их в снимок
+                    self.compact()
+                if not was_locked:
+                    self._unlock()
+            return self._data
+
+    def _read_snapshot(self, writable=True):
+        try:
+            with open(self.data_file, 'r') as f:
+                content = f.read().strip()
+        except FileNotFoundError:
+            return {}
+        if not content:
+            return {}
+        try:
+            return json.loads(content)
+        except json.JSONDecodeError as e:
+            if not writable:
+                logger.error("JSON loading error in %s: %s", self.data_file, e)
+                return {}
+            # Не затираем данные: откладываем испорченный файл в сторону
+            corrupt_file = f"{self.data_file}.corrupt-{int(time.time())}"
+            os.replace(self.data_file, corrupt_file)
+            logger.error("JSON loading error: %s. Damaged file moved to %s", e, corrupt_file)
+            return {}
+
+    # Счетчики, сохраненные вместе со снимком. Если они не сходятся со
+    # снимком (например, упали между записью файлов), пересчитываем.
+    def _read_aggregates(self):
+        try:
+            with open(self.aggregates_file, 'r') as f:
+                aggregates = ReviewAggregates.from_dict(json.load(f))
+        except (FileNotFoundError, json.JSONDecodeError, KeyError, TypeError):
+            return ReviewAggregates.rebuild(self._data)
+        review_count = sum(len(user_info.get('reviews', [])) for user_info in self._data.values())
+        if aggregates.review_count != review_count:
+            return ReviewAggregates.rebuild(self._data)
+        return aggregates
+
+    def aggregates(self):
+        with self.lock:
+            self.load()
+            return self._aggregates
+
+    def rebuild_aggregates(self):
+        with self.lock:
+            return ReviewAggregates.rebuild(self.load())
+
+    def verify_aggregates(self):
+        with self.lock:
+            return self.rebuild_aggregates() == self.aggregates()
+
+    # Индексы id -> (user_id, номер отзыва) и имя -> [user_id].
+    # Отзывам без id (из старых файлов) id выдаются по порядку снимка.
+    def _build_indexes(self):
+        self._review_ids = {}
+        self._user_names = {}
+        self._review_refs.clear()
+        missing = []
+        for user_id, user_info in self._data.items():
+            self._user_names.setdefault(user_info['name'], []).append(user_id)
+            for index, review in enumerate(user_info.get('reviews', [])):
+                if 'id' in review:
+                    self._review_ids[review['id']] = (user_id, index)
+                else:
+                    missing.append((user_id, index, review))
+        self._next_id = max(self._review_ids, default=0) + 1
+        for user_id, index, review in missing:
+            review['id'] = self._next_id
+            self._review_ids[review['id']] = (user_id, index)
+            self._next_id += 1
+        return len(missing)
+
+    def get_user(self, user_id):
+        with self.lock:
+            return self.load().get(str(user_id))
+
+    def get_review(self, review_id):
+        with self.lock:
+            self.load()
+            location = self._review_ids.get(review_id)
+            if location is None:
+                return None
+            user_id, index = location
+            return self._data[user_id], index
+
+    def find_users(self, name):
+        with self.lock:
+            self.load()
+            return list(self._user_names.get(name, []))
+
+    # Список id отзывов по возрастанию, по всем отзывам или только по одной
+    # позиции (тот же порядок, что у SQLite). Кэшируется до следующей записи.
+    def review_refs(self, position=None):
+        with self.lock:
+            refs = self._review_refs.get(position)
+            if refs is None:
+                refs = sorted(
+                    review['id']
+                    for user_info in self.load().values()
+                    for review in user_info.get('reviews', [])
+                    if position is None or position in review.get('positions', [])
+                )
+                self._review_refs[position] = refs
+            return refs
+
+    def iter_reviews(self, position=None, since=None, until=None, after_id=0):
+        if after_id:
+            with self.lock:
+                self.load()
+                review_ids = range(after_id + 1, self._next_id)
+        else:
+            review_ids = self.review_refs(position)
+        for review_id in review_ids:
+            with self.lock:
+                location = self._review_ids.get(review_id)
+                if location is None:
+                    continue  # Данные заменили во время выгрузки
+                user_id, index = location
+                user_info = self._data[user_id]
+                review = user_info['reviews'][index]
+            if position is not None and position not in review.get('positions', []):
+                continue
+            if in_date_range(review, since, until):
+                yield user_id, user_info['name'], user_info.get('nickname'), review
+
+    def last_review_id(self):
+        with self.lock:
+            self.load()
+            return self._next_id - 1
+
+    def review_count(self):
+        with self.lock:
+            self.load()
+            return len(self._review_ids)
+
+    def _replay_log(self, writable=True):
+        return replay_log(self.log_file, self._apply, truncate=writable)
+
+    # Применение записи журнала к индексу. Повторное применение (после
+    # сжатия) ничего не ломает: отзыв с таким id или, для записей без id,
+    # с таким номером у пользователя уже есть в снимке. Остальные записи
+    # применяются всегда, даже если номер не сходится (снимок потерян или
+    # отложен как испорченный): сжатие очистит журнал, и пропущенные
+    # отзывы пропали бы совсем.
+    def _apply(self, record):
+        user_id = record['user_id']
+        user_info = self._data.get(user_id)
+        if user_info is None:
+            user_info = {'name': record['name'], 'nickname': record['nickname'], 'reviews': []}
+            self._data[user_id] = user_info
+            self._user_names.setdefault(user_info['name'], []).append(user_id)
+        else:
+            user_info['nickname'] = record['nickname']
+        reviews = user_info['reviews']
+        review = record['review']
+        if 'id' in review:
+            if review['id'] in self._review_ids:
+                return False  # Уже есть в снимке
+        elif record['index'] < len(reviews):
+            return False  # Запись журнала из версии без id, уже в снимке
+        else:
+            review['id'] = self._next_id
+        if record['index'] != len(reviews):
+            logger.warning("Review %s of user %s was logged at index %d, stored at %d.",
+                           review['id'], user_id, record['index'], len(reviews))
+        self._review_ids[review['id']] = (user_id, len(reviews))
+        reviews.append(review)
+        self._next_id = max(self._next_id, review['id'] + 1)
+        self._aggregates.add(review)
+        self._add_ref(review)
+        return True
+
+    # Новый id обычно больше всех, поэтому кэшированные списки id просто
+    # дополняются, а не строятся и сортируются заново на каждую запись
+    def _add_ref(self, review):
+        for position, refs in list(self._review_refs.items()):
+            if position is not None and position not in review.get('positions', []):
+                continue
+            if refs and refs[-1] > review['id']:
+                del self._review_refs[position]
+            else:
+                refs.append(review['id'])
+
+    def append_review(self, user_id, name, nickname, review):
+        with self.lock:
+            self._lock_for_writing()
+            data = self.load()
+            user_id = str(user_id)
+            review['id'] = self._next_id
+            record = {
+                'user_id': user_id,
+                'name': name,
+                'nickname': nickname,
+                'index': len(data.get(user_id, {}).get('reviews', [])),
+                'review': review,
+            }
+            with open(self.log_file, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            self._apply(record)
+            self._log_records += 1
+            if self._log_records >= self.compact_every:
+                self.compact()
+            return review['id']
+
+    def size_bytes(self):
+        return sum(os.path.getsize(path) for path in (self.data_file, self.log_file) if os.path.exists(path))
+
+    # Полная замена данных (атомарно, через снимок)
+    def save(self, data):
+        with self.lock:
+            self._data = data
+            self._aggregates = ReviewAggregates.rebuild(data)
+            self._build_indexes()
+            self.compact()
+
+    # Сворачивание журнала в новый снимок
+    def compact(self):
+        with self.lock:
+            self._lock_for_writing()
+            data = self.load()
+            atomic_write(self.data_file, lambda f: json.dump(data, f, indent=4))
+            atomic_write(self.aggregates_file, lambda f: json.dump(self._aggregates.to_dict(), f))
+            # Если упадем здесь, повторное чтение журнала пропустит уже примененные записи
+            open(self.log_file, 'w').close()
+            self._log_records = 0
+
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    user_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    nickname TEXT
+);
+CREATE INDEX IF NOT EXISTS users_name ON users (name);
+CREATE TABLE IF NOT EXISTS reviews (
+    id INTEGER PRIMARY KEY,
+    user_id TEXT NOT NULL REFERENCES users (user_id),
+    user_index INTEGER NOT NULL,
+    experience_description TEXT,
+    satisfaction_rating INTEGER,
+    interaction_process_rating INTEGER,
+    professional_development_effect TEXT,
+    overall_satisfaction INTEGER,
+    created_at TEXT,
+    UNIQUE (user_id, user_index)
+);
+CREATE TABLE IF NOT EXISTS review_positions (
+    review_id INTEGER NOT NULL REFERENCES reviews (id),
+    position TEXT NOT NULL,
+    PRIMARY KEY (review_id, position)
+);
+CREATE INDEX IF NOT EXISTS review_positions_position ON review_positions (position, review_id);
+CREATE TABLE IF NOT EXISTS criterion_ratings (
+    review_id INTEGER NOT NULL REFERENCES reviews (id),
+    criterion TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    PRIMARY KEY (review_id, criterion)
+);
+CREATE INDEX IF NOT EXISTS criterion_ratings_criterion ON criterion_ratings (criterion, rating);
+CREATE TABLE IF NOT EXISTS aggregate_counts (
+    section TEXT NOT NULL,
+    key TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (section, key, rating)
+);
+"""
+
+# Колонки таблицы reviews, которые переносятся из/в словарь отзыва как есть
+REVIEW_COLUMNS = [
+    'experience_description',
+    'satisfaction_rating',
+    'interaction_process_rating',
+    'professional_development_effect',
+    'overall_satisfaction',
+    'created_at',
+]
+
+# Сколько отзывов читаем из базы за один запрос при выгрузке
+ITER_BATCH = 500
+
+
+# Встроенная база SQLite (режим WAL). Пользователи, отзывы, позиции и
+# оценки по критериям лежат в отдельных индексированных таблицах, так что
+# выборки по позиции и агрегаты считаются запросами, а не обходом всех данных.
+class SqliteStorage(Storage):
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self.lock = threading.RLock()
+        self._local = threading.local()
+        self._review_refs = {}
+        self._refs_version = None
+
+    # Отдельное соединение на каждый поток, схема создается при первом подключении
+    def _connection(self):
+        return thread_connection(self._local, self.db_file, self._setup_connection)
+
+    def _setup_connection(self, conn):
+        conn.execute('PRAGMA foreign_keys=ON')
+        with conn:
+            conn.executescript(SQLITE_SCHEMA)
+            # Базы, созданные до появления даты отзыва
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(reviews)")]
+            if 'created_at' not in columns:
+                conn.execute("ALTER TABLE reviews ADD COLUMN created_at TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS reviews_created_at ON reviews (created_at)")
+        self._init_counts(conn)
+
+    # Счетчики агрегатов ведутся в append_review. В базе, созданной до их
+    # появления, один раз заполняем их по отзывам (до первой записи, иначе
+    # append_review начал бы считать с нуля).
+    def _init_counts(self, conn):
+        if conn.execute("SELECT 1 FROM aggregate_counts WHERE section = 'total'").fetchone():
+            return
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if not conn.execute("SELECT 1 FROM aggregate_counts WHERE section = 'total'").fetchone():
+                self._store_counts(conn, self._count_rows(conn))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    # Строки aggregate_counts: (раздел, ключ, оценка); у позиций оценка 0
+    def _count_review(self, conn, review):
+        keys = [('total', '', 0)]
+        keys += [('rating', field, review[field]) for field in RATING_FIELDS if review.get(field) is not None]
+        keys += [('criterion', key, rating) for key, rating in review.get('multiple_ratings', {}).items()]
+        keys += [('position', position, 0) for position in review.get('positions', [])]
+        conn.executemany(
+            "INSERT INTO aggregate_counts (section, key, rating, count) VALUES (?, ?, ?, 1) "
+            "ON CONFLICT (section, key, rating) DO UPDATE SET count = count + 1",
+            keys
+        )
+
+    def _store_counts(self, conn, rows):
+        conn.execute("DELETE FROM aggregate_counts")
+        conn.executemany("INSERT INTO aggregate_counts (section, key, rating, count) VALUES (?, ?, ?, ?)", rows)
+
+    # Те же строки счетчиков, посчитанные по отзывам GROUP BY-запросами
+    def _count_rows(self, conn):
+        rows = [('total', '', 0, conn.execute("SELECT COUNT(*) FROM reviews").fetchone()[0])]
+        for field in RATING_FIELDS:
+            rows += [('rating', field, rating, count) for rating, count in conn.execute(
+                f"SELECT {field}, COUNT(*) FROM reviews WHERE {field} IS NOT NULL GROUP BY {field}"
+            )]
+        rows += [('criterion', criterion, rating, count) for criterion, rating, count in conn.execute(
+            "SELECT criterion, rating, COUNT(*) FROM criterion_ratings GROUP BY criterion, rating"
+        )]
+        rows += [('position', position, 0, count) for position, count in conn.execute(
+            "SELECT position, COUNT(*) FROM review_positions GROUP BY position"
+        )]
+        return rows
+
+    def init(self):
+        self._connection()
+
+    def _insert_review(self, conn, user_id, user_index, review):
+        cursor = conn.execute(
+            f"INSERT INTO reviews (id, user_id, user_index, {', '.join(REVIEW_COLUMNS)}) "
+            f"VALUES (?, ?, ?, {', '.join('?' for _ in REVIEW_COLUMNS)})",
+            [review.get('id'), user_id, user_index] + [review.get(column) for column in REVIEW_COLUMNS]
+        )
+        review_id = cursor.lastrowid
+        conn.executemany(
+            "INSERT INTO review_positions (review_id, position) VALUES (?, ?)",
+            [(review_id, position) for position in review.get('positions', [])]
+        )
+        conn.executemany(
+            "INSERT INTO criterion_ratings (review_id, criterion, rating) VALUES (?, ?, ?)",
+            [(review_id, key, rating) for key, rating in review.get('multiple_ratings', {}).items()]
+        )
+        return review_id
+
+    def append_review(self, user_id, name, nickname, review):
+        user_id = str(user_id)
+        with self.lock:
+            conn = self._connection()
+            with conn:
+                conn.execute(
+                    "INSERT INTO users (user_id, name, nickname) VALUES (?, ?, ?) "
+                    "ON CONFLICT (user_id) DO UPDATE SET nickname = excluded.nickname",
+                    (user_id, name, nickname)
+                )
+                user_index = conn.execute(
+                    "SELECT COUNT(*) FROM reviews WHERE user_id = ?", (user_id,)
+                ).fetchone()[0]
+                review['id'] = self._insert_review(conn, user_id, user_index, review)
+                self._count_review(conn, review)
+            self._review_refs.clear()
+            return review['id']
+
+    def save(self, data):
+        with self.lock:
+            conn = self._connection()
+            with conn:
+                conn.execute("DELETE FROM criterion_ratings")
+                conn.execute("DELETE FROM review_positions")
+                conn.execute("DELETE FROM reviews")
+                conn.execute("DELETE FROM users")
+                for user_id, user_info in data.items():
+                    conn.execute(
+                        "INSERT INTO users (user_id, name, nickname) VALUES (?, ?, ?)",
+                        (user_id, user_info['name'], user_info.get('nickname'))
+                    )
+                    for user_index, review in enumerate(user_info.get('reviews', [])):
+                        review['id'] = self._insert_review(conn, user_id, user_index, review)
+                self._store_counts(conn, self._count_rows(conn))
+            self._review_refs.clear()
+
+    # Сборка словаря отзыва из строки reviews и связанных таблиц
+    def _review_from_row(self, conn, row):
+        review_id = row[0]
+        review = {'id': review_id}
+        for column, value in zip(REVIEW_COLUMNS, row[1:]):
+            if value is not None:
+                review[column] = value
+        review['multiple_ratings'] = dict(conn.execute(
+            "SELECT criterion, rating FROM criterion_ratings WHERE review_id = ? ORDER BY rowid", (review_id,)
+        ).fetchall())
+        review['positions'] = [position for (position,) in conn.execute(
+            "SELECT position FROM review_positions WHERE review_id = ? ORDER BY rowid", (review_id,)
+        )]
+        return review
+
+    def get_user(self, user_id):
+        conn = self._connection()
+        row = conn.execute("SELECT name, nickname FROM users WHERE user_id = ?", (str(user_id),)).fetchone()
+        if row is None:
+            return None
+        rows = conn.execute(
+            f"SELECT id, {', '.join(REVIEW_COLUMNS)} FROM reviews WHERE user_id = ? ORDER BY user_index",
+            (str(user_id),)
+        ).fetchall()
+        return {
+            'name': row[0],
+            'nickname': row[1],
+            'reviews': [self._review_from_row(conn, review_row) for review_row in rows],
+        }
+
+    def load(self):
+        conn = self._connection()
+        user_ids = [user_id for (user_id,) in conn.execute("SELECT user_id FROM users ORDER BY rowid")]
+        return {user_id: self.get_user(user_id) for user_id in user_ids}
+
+    def get_review(self, review_id):
+        row = self._connection().execute(
+            "SELECT user_id, user_index FROM reviews WHERE id = ?", (review_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return self.get_user(row[0]), row[1]
+
+    def find_users(self, name):
+        return [user_id for (user_id,) in self._connection().execute(
+            "SELECT user_id FROM users WHERE name = ? ORDER BY rowid", (name,)
+        )]
+
+    # Кэш сбрасывается и при записи другим процессом: id отзывов только растут,
+    # так что максимальный id служит номером версии
+    def review_refs(self, position=None):
+        with self.lock:
+            conn = self._connection()
+            version = conn.execute("SELECT MAX(id) FROM reviews").fetchone()[0]
+            if version != self._refs_version:
+                self._review_refs.clear()
+                self._refs_version = version
+            refs = self._review_refs.get(position)
+            if refs is None:
+                if position is None:
+                    cursor = conn.execute("SELECT id FROM reviews ORDER BY id")
+                else:
+                    cursor = conn.execute(
+                        "SELECT review_id FROM review_positions WHERE position = ? ORDER BY review_id", (position,)
+                    )
+                refs = [review_id for (review_id,) in cursor]
+                self._review_refs[position] = refs
+            return refs
+
+    # Читаем порциями по id, чтобы не держать долгую транзакцию чтения и всю выборку в памяти
+    def iter_reviews(self, position=None, since=None, until=None, after_id=0):
+        conn = self._connection()
+        joins = ["JOIN users u ON u.user_id = r.user_id"]
+        conditions = []
+        params = []
+        if position is not None:
+            joins.append("JOIN review_positions p ON p.review_id = r.id AND p.position = ?")
+            params.append(position)
+        if since is not None:
+            conditions.append("r.created_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("r.created_at < ?")
+            params.append(until)
+        conditions.append("r.id > ?")
+        query = (
+            f"SELECT r.user_id, u.name, u.nickname, r.id, {', '.join('r.' + column for column in REVIEW_COLUMNS)} "
+            f"FROM reviews r {' '.join(joins)} WHERE {' AND '.join(conditions)} ORDER BY r.id LIMIT {ITER_BATCH}"
+        )
+        last_id = after_id
+        while True:
+            rows = conn.execute(query, params + [last_id]).fetchall()
+            for row in rows:
+                yield row[0], row[1], row[2], self._review_from_row(conn, row[3:])
+            if len(rows) < ITER_BATCH:
+                return
+            last_id = rows[-1][3]
+
+    def last_review_id(self):
+        return self._connection().execute("SELECT MAX(id) FROM reviews").fetchone()[0] or 0
+
+    def review_count(self):
+        row = self._connection().execute("SELECT count FROM aggregate_counts WHERE section = 'total'").fetchone()
+        return row[0] if row else 0
+
+    # Агрегаты из счетчиков aggregate_counts, которые append_review обновляет
+    # в той же транзакции, что и отзыв
+    def aggregates(self):
+        return self._aggregates_from_rows(self._connection().execute(
+            "SELECT section, key, rating, count FROM aggregate_counts ORDER BY section, key, rating"
+        ))
+
+    # Пересчет по самим отзывам (GROUP BY по индексам), для проверки счетчиков
+    def rebuild_aggregates(self):
+        return self._aggregates_from_rows(self._count_rows(self._connection()))
+
+    def _aggregates_from_rows(self, rows):
+        aggregates = ReviewAggregates()
+        for section, key, rating, count in rows:
+            if section == 'total':
+                aggregates.review_count = count
+            elif section == 'rating':
+                add_rating_count(aggregates.ratings[key], rating, count)
+            elif section == 'criterion':
+                if key not in aggregates.criteria:
+                    aggregates.criteria[key] = empty_counter()
+                add_rating_count(aggregates.criteria[key], rating, count)
+            elif section == 'position':
+                aggregates.positions[key] = count
+        return aggregates
+
+    def compact(self):
+        with self.lock:
+            self._connection().execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def size_bytes(self):
+        paths = (self.db_file, self.db_file + '-wal')
+        return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+# Выбор хранилища по имени бэкенда ('json' или 'sqlite')
+def create_storage(backend, data_file, db_file):
+    if backend == 'json':
+        return JsonStorage(data_file)
+    if backend == 'sqlite':
+        return SqliteStorage(db_file)
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+# Разовый перенос messages.json в базу SQLite. save() заменяет все данные
+# базы, поэтому в непустую базу переносим только с force=True.
+def import_json(data_file, db_file, force=False):
+    data = JsonStorage(data_file).load()
+    target = SqliteStorage(db_file)
+    target.init()
+    if not force:
+        users = target._connection().execute("SELECT COUNT(*) FROM users").fetchone()[0]
+        if users:
+            raise ValueError(
+                f"{db_file} already holds {target.review_count()} reviews of {users} users; "
+                "use --force to replace them"
+            )
+    target.save(data)
+    return sum(len(user_info.get('reviews', [])) for user_info in data.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check or migrate the review storage.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    verify = commands.add_parser('verify', help="check the running aggregates against the stored reviews")
+    verify.add_argument('--backend', choices=['json', 'sqlite'], default=os.getenv('STORAGE_BACKEND', 'json'))
+    verify.add_argument('file', nargs='?', help="data file (json) or database (sqlite)")
+    migrate = commands.add_parser('import', help="copy messages.json into an empty SQLite database")
+    migrate.add_argument('data_file', nargs='?', default='./data/messages.json')
+    migrate.add_argument('db_file', nargs='?', default='./data/messages.db')
+    migrate.add_argument('--force', action='store_true', help="replace the data already in the database")
+    args = parser.parse_args()
+
+    if args.command == 'verify':
+        path = args.file or ('./data/messages.db' if args.backend == 'sqlite' else './data/messages.json')
+        if not os.path.exists(path):
+            sys.exit(f"{path} does not exist")
+        store = create_storage(args.backend, path, path)
+        if store.verify_aggregates():
+            print("Aggregates match the stored reviews.")
+        else:
+            print("Aggregates differ from the stored reviews.")
+            sys.exit(1)
+    else:
+        try:
+            count = import_json(args.data_file, args.db_file, args.force)
+        except ValueError as e:
+            sys.exit(str(e))
+        print(f"Imported {count} reviews from {args.data_file} into {args.db_file}.")
+
+
+if __name__ == '__main__':
+    # python storage.py verify [--backend json|sqlite] [FILE]
+    # python storage.py import [DATA_FILE] [DB_FILE] [--force]
+    main()
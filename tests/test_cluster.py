@@ -0,0 +1,104 @@
+import threading
+import time
+
+import cluster
+
+
+def make_leases(tmp_path, ttl=0.3):
+    db_file = str(tmp_path / 'messages.db')
+    return cluster.Lease(db_file, holder='a', ttl=ttl), cluster.Lease(db_file, holder='b', ttl=ttl)
+
+
+def test_only_one_holder_at_a_time(tmp_path):
+    a, b = make_leases(tmp_path)
+    assert a.acquire()
+    assert not b.acquire()
+    assert a.holder_id() == b.holder_id() == 'a'
+
+
+def test_renewal_keeps_the_lease(tmp_path):
+    a, b = make_leases(tmp_path)
+    assert a.acquire()
+    for _ in range(3):
+        time.sleep(0.15)
+        assert a.acquire(update_offset=10)
+        assert not b.acquire()
+    assert b.update_offset() == 10
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    a, b = make_leases(tmp_path)
+    assert a.acquire(update_offset=5)
+    time.sleep(0.35)
+    assert a.holder_id() is None
+    assert b.acquire()
+    assert not a.acquire()
+    # Смещение переходит к новому лидеру и не уменьшается
+    assert b.update_offset() == 5
+    assert b.acquire(update_offset=3) and b.update_offset() == 5
+
+
+def test_release_hands_over_at_once_with_the_final_offset(tmp_path):
+    a, b = make_leases(tmp_path, ttl=30)
+    assert a.acquire(update_offset=5)
+    b.release(update_offset=99)  # Чужую аренду отдать нельзя
+    assert not b.acquire()
+    a.release(update_offset=8)
+    assert b.acquire()
+    assert b.update_offset() == 8
+
+
+class FakeBot:
+    def __init__(self):
+        self.last_update_id = 0
+        self.polls = 0
+        self.stop = threading.Event()
+
+    def remove_webhook(self):
+        pass
+
+    def infinity_polling(self, **kwargs):
+        self.polls += 1
+        self.stop.clear()
+        while not self.stop.wait(0.01):
+            self.last_update_id += 1
+
+    def stop_polling(self):
+        self.stop.set()
+
+
+# Лидер опрашивает, резерв ждет; после остановки лидера и освобождения
+# аренды резерв продолжает с сохраненного смещения
+def test_standby_takes_over_after_leader_stops(tmp_path):
+    a, b = make_leases(tmp_path, ttl=0.3)
+    leader, standby = FakeBot(), FakeBot()
+    stop_leader, stop_standby = threading.Event(), threading.Event()
+
+    def run(bot, lease, stopping):
+        try:
+            cluster.run_leader_polling(bot, lease, stopping)
+        finally:
+            lease.release(bot.last_update_id)
+
+    first = threading.Thread(target=run, args=(leader, a, stop_leader))
+    first.start()
+    time.sleep(0.1)
+    second = threading.Thread(target=run, args=(standby, b, stop_standby))
+    second.start()
+    time.sleep(0.2)
+    assert leader.polls == 1 and standby.polls == 0
+
+    stop_leader.set()
+    leader.stop_polling()
+    first.join(2)
+    assert not first.is_alive()
+    deadline = time.monotonic() + 2
+    while not standby.polls and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert standby.polls == 1
+    assert standby.last_update_id >= leader.last_update_id
+
+    stop_standby.set()
+    standby.stop_polling()
+    second.join(2)
+    assert not second.is_alive()
@@ -0,0 +1,127 @@
+import threading
+import time
+
+import requests
+from telebot.apihelper import ApiTelegramException
+
+import outbound
+
+
+# Заглушка бота: записывает вызовы (время, метод, аргументы) и по очереди
+# выбрасывает заданные для метода ошибки
+class StubBot:
+    def __init__(self, failures=None):
+        self.calls = []
+        self.failures = failures or {}
+        self.gates = {}
+        self.lock = threading.Lock()
+
+    def __getattr__(self, method):
+        def call(*args, **kwargs):
+            gate = self.gates.get((method, args[0] if args else kwargs.get('chat_id')))
+            if gate is not None:
+                gate.wait(5)
+            with self.lock:
+                self.calls.append((time.monotonic(), method, args, kwargs))
+                errors = self.failures.get(method)
+                if errors:
+                    raise errors.pop(0)
+        return call
+
+    def sent(self, method):
+        return [(at, args, kwargs) for at, name, args, kwargs in self.calls if name == method]
+
+
+def too_many_requests(retry_after):
+    return ApiTelegramException('sendMessage', None, {
+        'error_code': 429, 'description': 'Too Many Requests', 'parameters': {'retry_after': retry_after},
+    })
+
+
+def make_sender(bot, **kwargs):
+    options = dict(global_rate=1000, chat_rate=1000, chat_burst=1000, num_threads=4)
+    options.update(kwargs)
+    return outbound.OutboundSender(bot, **options)
+
+
+def test_token_bucket_limits_rate():
+    bucket = outbound.TokenBucket(rate=2, capacity=2)
+    now = bucket.updated
+    bucket.take(now)
+    bucket.take(now)
+    assert bucket.wait_time(now) == 0.5
+    assert bucket.wait_time(now + 0.5) == 0
+    bucket.blocked_until = now + 3
+    assert bucket.wait_time(now + 1) == 2
+
+
+def test_messages_keep_order_within_a_chat():
+    bot = StubBot()
+    sender = make_sender(bot)
+    for i in range(30):
+        sender.send_message(i % 3, f"message {i}")
+    assert sender.join(5)
+
+    for chat_id in range(3):
+        texts = [args[1] for _, args, _ in bot.sent('send_message') if args[0] == chat_id]
+        assert texts == [f"message {i}" for i in range(chat_id, 30, 3)]
+
+
+def test_chat_rate_limit_spaces_messages():
+    bot = StubBot()
+    sender = make_sender(bot, chat_rate=10, chat_burst=1)
+    for i in range(4):
+        sender.send_message(1, f"message {i}")
+    assert sender.join(5)
+
+    times = [at for at, _, _ in bot.sent('send_message')]
+    assert times[-1] - times[0] >= 0.25
+
+
+# 429 откладывает запрос на retry_after и повторяет его, не нарушая порядок
+def test_retry_after_is_respected():
+    bot = StubBot({'send_message': [too_many_requests(0.3)]})
+    sender = make_sender(bot)
+    started = time.monotonic()
+    sender.send_message(1, "first")
+    sender.send_message(1, "second")
+    assert sender.join(5)
+
+    sent = bot.sent('send_message')
+    assert [args[1] for _, args, _ in sent] == ["first", "first", "second"]
+    assert sent[1][0] - started >= 0.3
+
+
+# Повторные изменения одной клавиатуры, пока чат занят, схлопываются в последнее
+def test_repeated_markup_edits_are_coalesced():
+    bot = StubBot()
+    gate = bot.gates[('send_message', 1)] = threading.Event()
+    sender = make_sender(bot)
+    sender.send_message(1, "hold the chat")
+    time.sleep(0.1)
+    for markup in range(5):
+        sender.edit_message_reply_markup(chat_id=1, message_id=7, reply_markup=markup)
+    gate.set()
+    assert sender.join(5)
+
+    edits = bot.sent('edit_message_reply_markup')
+    assert [kwargs['reply_markup'] for _, _, kwargs in edits] == [4]
+
+
+# Сетевая ошибка при ответе на кнопку откладывает только этот ответ,
+# остальные чаты отправляются сразу
+def test_callback_answer_backoff_does_not_block_other_chats():
+    bot = StubBot({'answer_callback_query': [requests.exceptions.ConnectionError("reset")]})
+    sender = make_sender(bot)
+    started = time.monotonic()
+    sender.answer_callback_query('query-1')
+    time.sleep(0.05)
+    for chat_id in range(5):
+        sender.send_message(chat_id, "hello")
+    assert sender.join(5)
+
+    messages = bot.sent('send_message')
+    answers = bot.sent('answer_callback_query')
+    assert len(messages) == 5 and len(answers) == 2
+    assert max(at for at, _, _ in messages) - started < 0.5
+    assert answers[1][0] - started >= 1
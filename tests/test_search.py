@@ -0,0 +1,25 @@
+import os
+
+import search
+import storage
+
+
+# Оборванная запись журнала индекса обрезается, а отзыв доиндексирует sync()
+def test_torn_index_log_is_truncated_and_reindexed(tmp_path):
+    store = storage.JsonStorage(str(tmp_path / 'messages.json'))
+    store.init()
+    store.append_review(1, 'Ann', None, {'experience_description': 'опыт работы'})
+    index = search.SearchIndex(str(tmp_path / 'messages.search.json'))
+    index.sync(store)
+    store.append_review(2, 'Bob', None, {'experience_description': 'карьерный рост'})
+    index.add(store.get_review(2)[0]['reviews'][0])
+    good_size = os.path.getsize(index.log_file)
+    with open(index.log_file, 'a') as f:
+        f.write('{"id": 3, "ter')
+    store.append_review(3, 'Cat', None, {'experience_description': 'новый опыт'})
+
+    index = search.SearchIndex(index.index_file)
+    index.load()
+    assert len(index) == 2 and os.path.getsize(index.log_file) == good_size
+    assert sorted(index.sync(store).search('опыт')) == [1, 3]
+    assert index.search('карьерный') == [2]
@@ -0,0 +1,186 @@
+import json
+import os
+import random
+
+import pytest
+
+import storage
+from aggregates import ReviewAggregates
+
+
+def make_review(rng):
+    return {
+        'experience_description': 'text',
+        'satisfaction_rating': rng.randint(1, 5),
+        'overall_satisfaction': rng.randint(1, 5),
+        'multiple_ratings': {'Team': rng.randint(1, 5), 'Tasks': rng.randint(1, 5)},
+        'positions': rng.sample(['Backend Developer', 'QA Engineer', 'Designer'], 2),
+    }
+
+
+@pytest.fixture
+def json_store(tmp_path):
+    store = storage.JsonStorage(str(tmp_path / 'messages.json'))
+    store.init()
+    return store
+
+
+def reopen(store):
+    store._unlock()
+    return storage.JsonStorage(store.data_file)
+
+
+# Оборванная при падении последняя запись журнала отбрасывается и обрезается,
+# а следующая запись не склеивается с ней
+def test_torn_log_tail_is_truncated(json_store):
+    json_store.append_review(1, 'Ann', None, {'overall_satisfaction': 4})
+    json_store.append_review(2, 'Bob', None, {'overall_satisfaction': 5})
+    good_size = os.path.getsize(json_store.log_file)
+    with open(json_store.log_file, 'a') as f:
+        f.write('{"user_id": "3", "name": "Ca')
+
+    store = reopen(json_store)
+    assert [review['id'] for _, _, _, review in store.iter_reviews()] == [1, 2]
+    assert os.path.getsize(store.log_file) == good_size
+    store.append_review(3, 'Cat', None, {'overall_satisfaction': 3})
+
+    store = reopen(store)
+    assert store.review_count() == 3
+    assert store.get_review(3)[0]['name'] == 'Cat'
+
+
+# Читатель без блокировки (файлы держит бот) журнал не трогает. flock
+# конфликтует и между двумя открытиями файла в одном процессе.
+@pytest.mark.skipif(storage.fcntl is None, reason="no file locks on this platform")
+def test_reader_leaves_torn_tail_to_lock_holder(json_store):
+    json_store.append_review(1, 'Ann', None, {'overall_satisfaction': 4})
+    with open(json_store.log_file, 'a') as f:
+        f.write('{"user_id"')
+    size = os.path.getsize(json_store.log_file)
+
+    reader = storage.JsonStorage(json_store.data_file)
+    assert reader.review_count() == 1
+    assert os.path.getsize(json_store.log_file) == size
+
+
+def test_corrupt_snapshot_is_moved_aside(tmp_path):
+    data_file = tmp_path / 'messages.json'
+    data_file.write_text('{"1": {"name": "Ann", "reviews": [')
+    store = storage.JsonStorage(str(data_file))
+    store.init()
+
+    assert store.load() == {}
+    corrupt = [name for name in os.listdir(tmp_path) if name.startswith('messages.json.corrupt-')]
+    assert len(corrupt) == 1
+    assert (tmp_path / corrupt[0]).read_text() == '{"1": {"name": "Ann", "reviews": ['
+
+
+# Отзывы из журнала, записанные поверх испорченного снимка, не теряются:
+# их номера у пользователя не сходятся с пустыми данными, но они применяются
+# и после сжатия остаются в новом снимке
+def test_corrupt_snapshot_keeps_pending_log_records(tmp_path):
+    data_file = tmp_path / 'messages.json'
+    data_file.write_text('{"1": {"name": "Ann", "reviews": [')
+    (tmp_path / 'messages.log').write_text(json.dumps({
+        'user_id': '1', 'name': 'Ann', 'nickname': None, 'index': 3,
+        'review': {'id': 4, 'overall_satisfaction': 5},
+    }) + '\n')
+    store = storage.JsonStorage(str(data_file))
+    store.init()
+
+    assert store.get_user(1)['reviews'] == [{'id': 4, 'overall_satisfaction': 5}]
+    store.compact()
+    assert os.path.getsize(store.log_file) == 0
+
+    store = reopen(store)
+    assert store.get_review(4)[0]['name'] == 'Ann'
+    assert store.append_review(1, 'Ann', None, {'overall_satisfaction': 3}) == 5
+    assert store.aggregates().review_count == 2
+
+
+# Падение после записи снимка, но до очистки журнала: записи журнала уже
+# есть в снимке, повторное чтение не должно их задвоить
+def test_replay_after_interrupted_compaction_is_idempotent(json_store):
+    rng = random.Random(1)
+    for user_id in (1, 2, 1):
+        json_store.append_review(user_id, f'User {user_id}', None, make_review(rng))
+    with open(json_store.log_file) as f:
+        log = f.read()
+    json_store.compact()
+    with open(json_store.log_file, 'w') as f:
+        f.write(log)
+
+    store = reopen(json_store)
+    assert store.review_count() == 3
+    assert len(store.get_user(1)['reviews']) == 2
+    assert store.aggregates().review_count == 3
+    assert store.verify_aggregates()
+
+
+# Отзывам из старых файлов без id выдаются id по порядку снимка и сразу
+# сохраняются в снимок; запись журнала без id получает следующий
+def test_legacy_reviews_get_ids(tmp_path):
+    data_file = tmp_path / 'messages.json'
+    data_file.write_text(json.dumps({
+        '10': {'name': 'Ann', 'nickname': None, 'reviews': [{'overall_satisfaction': 4}, {'overall_satisfaction': 2}]},
+        '20': {'name': 'Bob', 'nickname': None, 'reviews': [{'id': 7, 'overall_satisfaction': 5}]},
+    }))
+    (tmp_path / 'messages.log').write_text(json.dumps({
+        'user_id': '20', 'name': 'Bob', 'nickname': None, 'index': 1, 'review': {'overall_satisfaction': 3},
+    }) + '\n')
+    store = storage.JsonStorage(str(data_file))
+    store.init()
+
+    data = store.load()
+    assert [review['id'] for review in data['10']['reviews']] == [8, 9]
+    assert [review['id'] for review in data['20']['reviews']] == [7, 10]
+    saved = json.loads(data_file.read_text())
+    assert [review['id'] for review in saved['10']['reviews']] == [8, 9]
+    assert store.append_review(10, 'Ann', None, {'overall_satisfaction': 1}) == 11
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_aggregates_match_rebuild(tmp_path, backend):
+    store = storage.create_storage(backend, str(tmp_path / 'messages.json'), str(tmp_path / 'messages.db'))
+    store.init()
+    rng = random.Random(2)
+    data = {}
+    for _ in range(200):
+        user_id = str(rng.randint(1, 30))
+        review = make_review(rng)
+        store.append_review(user_id, f'User {user_id}', None, dict(review))
+        data.setdefault(user_id, {'name': f'User {user_id}', 'nickname': None, 'reviews': []})['reviews'].append(review)
+
+    assert store.aggregates() == store.rebuild_aggregates() == ReviewAggregates.rebuild(data)
+    assert store.verify_aggregates()
+
+
+# Перенос в базу, где уже есть данные, без force не затирает их
+def test_import_json_refuses_non_empty_database(json_store, tmp_path):
+    json_store.append_review(1, 'Ann', None, {'overall_satisfaction': 4})
+    db_file = str(tmp_path / 'messages.db')
+    target = storage.SqliteStorage(db_file)
+    target.append_review(2, 'Bob', None, {'overall_satisfaction': 5})
+
+    with pytest.raises(ValueError):
+        storage.import_json(json_store.data_file, db_file)
+    assert target.review_count() == 1 and target.get_user(2) is not None
+
+    assert storage.import_json(json_store.data_file, db_file, force=True) == 1
+    assert target.get_user(2) is None and target.get_user(1)['name'] == 'Ann'
+
+
+# Оба хранилища отдают отзывы по порядку id, а не по пользователям
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_reviews_are_iterated_in_id_order(tmp_path, backend):
+    store = storage.create_storage(backend, str(tmp_path / 'messages.json'), str(tmp_path / 'messages.db'))
+    store.init()
+    for user_id in (1, 2, 1):
+        store.append_review(user_id, f'User {user_id}', None, {'overall_satisfaction': 4, 'positions': ['QA Engineer']})
+        # Кэш списков id обновляется на каждую запись
+        assert store.review_refs('QA Engineer')[-1] == store.review_refs()[-1]
+    store.append_review(3, 'User 3', None, {'overall_satisfaction': 4, 'positions': ['Designer']})
+
+    assert store.review_refs() == [1, 2, 3, 4]
+    assert store.review_refs('QA Engineer') == [1, 2, 3]
+    assert [review['id'] for _, _, _, review in store.iter_reviews()] == [1, 2, 3, 4]
@@ -0,0 +1,76 @@
+import hmac
+import logging
+import os
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telebot import types
+
+# Публичный адрес (https, TLS терминирует балансировщик/прокси) и локальный порт
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+
+# Telegram присылает секрет из setWebhook в этом заголовке
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+# Обновления больше этого размера не принимаем
+MAX_UPDATE_SIZE = 1024 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+# Принимает обновления от Telegram: проверяет секрет, ставит обновление в
+# очередь обработчиков бота и сразу отвечает 200, не дожидаясь обработки.
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        if self.path != self.server.webhook_path:
+            self.send_error(404)
+            return
+        secret = self.server.secret
+        if not secret or not hmac.compare_digest(self.headers.get(SECRET_HEADER, ''), secret):
+            self.send_error(403)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if not 0 < length <= MAX_UPDATE_SIZE:
+            self.send_error(400)
+            return
+        try:
+            update = types.Update.de_json(self.rfile.read(length).decode('utf-8'))
+        except Exception as e:
+            logger.warning("Invalid update: %s", e)
+            self.send_error(400)
+            return
+        self.server.bot.process_new_updates([update])
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass  # Не пишем строку в лог на каждое обновление
+
+
+def make_server(bot, secret=WEBHOOK_SECRET, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH):
+    server = ThreadingHTTPServer((host, port), WebhookHandler)
+    server.daemon_threads = True
+    server.bot = bot
+    server.secret = secret
+    server.webhook_path = path
+    return server
+
+
+# Регистрирует webhook в Telegram и обслуживает входящие обновления
+def run_webhook(bot, url=WEBHOOK_URL, secret=WEBHOOK_SECRET, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH):
+    if not url:
+        raise ValueError("WEBHOOK_URL must be set in webhook mode")
+    # Без секрета любой, кто знает адрес, может слать боту поддельные обновления
+    if not secret:
+        raise ValueError("WEBHOOK_SECRET must be set in webhook mode")
+    server = make_server(bot, secret, host, port, path)
+    bot.remove_webhook()
+    bot.set_webhook(url=url.rstrip('/') + path, secret_token=secret)
+    logger.info("Webhook server listening on %s:%d%s", host, port, path)
+    server.serve_forever()